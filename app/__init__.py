@@ -10,14 +10,17 @@ import logging
 import os
 from datetime import timedelta
 from decimal import Decimal, InvalidOperation
+from functools import lru_cache
 
-from babel.core import UnknownLocaleError
-from babel.numbers import format_currency as babel_currency, get_currency_symbol
+from babel.core import Locale, UnknownLocaleError
+from babel.numbers import get_currency_symbol, parse_pattern
 from flask import Flask, current_app, session
+from jinja2 import FileSystemBytecodeCache
 
 from .db import db
 from .extensions import csrf, login_manager, bcrypt
 from .blueprints import register_blueprints
+from .json_provider import init_json_provider
 from flask_migrate import Migrate
 
 
@@ -26,6 +29,9 @@ migrate = Migrate()
 _DEFAULT_CURRENCY_CODE = os.getenv("CURRENCY_CODE", "EUR")
 _DEFAULT_CURRENCY_LOCALE = os.getenv("CURRENCY_LOCALE", "es_ES")
 _DEFAULT_CURRENCY_SYMBOL = os.getenv("CURRENCY_SYMBOL")
+# Patrón de importes compilado una vez; Babel lo volvería a parsear en cada
+# llamada a su format_currency.
+_CURRENCY_PATTERN = parse_pattern("¤#,##0.00")
 
 
 def _get_bool_env(var_name: str, default: bool) -> bool:
@@ -36,6 +42,18 @@ def _get_bool_env(var_name: str, default: bool) -> bool:
     return value.lower() in {"1", "true", "t", "yes", "y"}
 
 
+def _precompilar_plantillas(app):
+    """Compila todas las plantillas al arrancar y las deja en la caché de Jinja.
+
+    Sin esto la primera visita a cada vista paga el parseo y la compilación
+    de su plantilla (y de base.html). Fuera de debug Flask no recarga
+    plantillas, así que lo compilado aquí sirve para toda la vida del proceso.
+    """
+
+    for nombre in app.jinja_env.list_templates(extensions=("html",)):
+        app.jinja_env.get_template(nombre)
+
+
 def _currency_config(app=None):
     """Obtiene la configuración activa de moneda a partir de app o entorno."""
 
@@ -63,6 +81,18 @@ def _currency_config(app=None):
     return config
 
 
+@lru_cache(maxsize=32)
+def _currency_locale(locale_name, currency_code):
+    """Locale de Babel y símbolo de la moneda, resueltos una vez por combinación.
+
+    El filtro ``currency`` se aplica a cada celda de las tablas; con esto sólo
+    la primera llamada para un (locale, moneda) consulta los datos CLDR.
+    """
+
+    locale_obj = Locale.parse(locale_name)
+    return locale_obj, get_currency_symbol(currency_code, locale=locale_obj)
+
+
 def _resolve_currency_symbol(currency_code=None, locale=None, explicit_symbol=None):
     """Resuelve el símbolo a mostrar combinando overrides, locale y código."""
 
@@ -72,7 +102,7 @@ def _resolve_currency_symbol(currency_code=None, locale=None, explicit_symbol=No
     code = currency_code or config["code"]
     locale_name = locale or config["locale"]
     try:
-        return get_currency_symbol(code, locale=locale_name)
+        return _currency_locale(locale_name, code)[1]
     except (UnknownLocaleError, ValueError):
         return code
 
@@ -91,7 +121,8 @@ def format_currency(value, symbol: str | None = None, currency_code: str | None
     symbol_override = symbol or config["symbol"]
 
     try:
-        formatted = babel_currency(amount, code, locale=locale_name, format="¤#,##0.00")
+        locale_obj, default_symbol = _currency_locale(locale_name, code)
+        formatted = _CURRENCY_PATTERN.apply(amount, locale_obj, currency=code)
     except (UnknownLocaleError, ValueError):
         formatted_amount = f"{amount:,.2f}"
         formatted_amount = formatted_amount.replace(",", "X").replace(".", ",").replace("X", ".")
@@ -99,10 +130,6 @@ def format_currency(value, symbol: str | None = None, currency_code: str | None
         return f"{resolved_symbol}{formatted_amount}"
 
     if symbol_override:
-        try:
-            default_symbol = get_currency_symbol(code, locale=locale_name)
-        except (UnknownLocaleError, ValueError):
-            default_symbol = ""
         if default_symbol and default_symbol in formatted:
             formatted = formatted.replace(default_symbol, symbol_override, 1)
         else:
@@ -119,6 +146,8 @@ def create_app():
     """
 
     app = Flask(__name__, template_folder="templates", static_folder="static")
+    # jsonify (endpoints AJAX y de reportes) serializa con orjson si está disponible.
+    init_json_provider(app)
     environment = os.getenv("FLASK_ENV", os.getenv("ENV", "production")).lower()
 
     # Logging básico para depurar en desarrollo. Se puede ajustar por
@@ -177,6 +206,11 @@ def create_app():
     )
     app.config.setdefault("CONTENT_SECURITY_POLICY", os.getenv("CONTENT_SECURITY_POLICY", default_csp))
 
+    # Coste de bcrypt configurable por entorno. Flask-Bcrypt lo resuelve una
+    # sola vez en init_app, así que el hash de cada registro/login no vuelve a
+    # consultar la configuración; las pruebas pueden bajarlo para ir rápido.
+    app.config.setdefault("BCRYPT_LOG_ROUNDS", int(os.getenv("BCRYPT_LOG_ROUNDS", "12")))
+
     # Inicializar extensiones con la app actual.
     db.init_app(app)
     bcrypt.init_app(app)
@@ -216,6 +250,18 @@ def create_app():
         from . import models  # noqa: F401
         register_blueprints(app)
 
+    # Con JINJA_CACHE_DIR el bytecode compilado se guarda en disco y los
+    # workers que arrancan (o se reciclan) lo cargan sin volver a compilar.
+    jinja_cache_dir = os.getenv("JINJA_CACHE_DIR")
+    if jinja_cache_dir:
+        os.makedirs(jinja_cache_dir, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(jinja_cache_dir)
+
+    # Activo por defecto en producción; en desarrollo y pruebas se compila bajo
+    # demanda para no alargar el arranque.
+    if _get_bool_env("PRECOMPILE_TEMPLATES", environment == "production"):
+        _precompilar_plantillas(app)
+
     @app.context_processor
     def inject_currency_meta():
         config = _currency_config(app)
@@ -4,8 +4,7 @@ Agrupa las rutas de login/registro y acciones de administración para
 reducir el monolito previo y documentar por qué se ajusta cada flujo.
 """
 
-import csv
-import io
+import logging
 import time
 from datetime import datetime, timedelta
 
@@ -19,21 +18,28 @@ from flask import (
     render_template,
     request,
     session,
+    stream_with_context,
     url_for,
 )
 from flask_login import current_user, login_required, login_user, logout_user
+from sqlalchemy import exists, select
+from sqlalchemy.orm import contains_eager, load_only
 
 from ..db import db
 from ..extensions import login_manager
 from ..forms import Formulario_de_registro, Login_form
-from ..models import ActividadUsuario, Compra, Usuario
-from .helpers import registrar_actividad, role_required, write_safe_csv_row
+from ..models import ActividadUsuario, Compra, Producto, Proveedor, Usuario
+from .helpers import admin_required, iter_safe_csv, registrar_actividad
+from .reportes import invalidar_cache_reportes
 
 
 auth_bp = Blueprint("auth", __name__)
 _LOGIN_ATTEMPTS: dict[str, list[float]] = {}
 _LOGIN_WINDOW_SECONDS = 600
 _LOGIN_MAX_ATTEMPTS = 5
+# Filas por lote al exportar: se leen y se envían al cliente lote a lote, así
+# que ni la consulta ni el CSV crecen en memoria con el histórico.
+_EXPORT_BATCH = 1000
 
 
 def _is_rate_limited():
@@ -58,9 +64,18 @@ def _reset_rate_limit():
 
 @login_manager.user_loader
 def cargar_usuario(usuario_id):
-    """Obtiene el usuario por ID usando SQLAlchemy 2.x (db.session.get)."""
+    """Carga el usuario de la sesión con sólo las columnas de identidad y rol.
 
-    return db.session.get(Usuario, str(usuario_id))
+    Se ejecuta en cada petición autenticada; Flask-Login ya guarda el
+    resultado en ``g._login_user`` para el resto de la petición. El hash y
+    la dirección quedan diferidos y sólo se consultan si una vista los usa.
+    """
+
+    return db.session.scalars(
+        select(Usuario)
+        .options(load_only(Usuario.id, Usuario.nombre, Usuario.usuario, Usuario.rol))
+        .filter_by(id=str(usuario_id))
+    ).first()
 
 
 @auth_bp.route("/", methods=["GET"])
@@ -82,8 +97,7 @@ def registro():
         app.logger.debug("El formulario pasó las validaciones.")
 
         # Validación previa para evitar IntegrityError y guiar al usuario.
-        usuario_existente = Usuario.query.filter_by(usuario=form.usuario.data).first()
-        if usuario_existente:
+        if db.session.scalar(select(exists().where(Usuario.usuario == form.usuario.data))):
             flash("El nombre de usuario ya está registrado.", "warning")
             return render_template("registro.html", form=form)
 
@@ -99,14 +113,15 @@ def registro():
             app.logger.info("Nuevo usuario creado: %s", nuevo_usuario.usuario)
 
             db.session.add(nuevo_usuario)
-            db.session.commit()
-            app.logger.debug("Usuario guardado en la base de datos.")
-
+            db.session.flush()  # ID del usuario para la actividad
             registrar_actividad(
                 usuario_id=nuevo_usuario.id,
                 accion=f"Registró un nuevo usuario: {nuevo_usuario.usuario}",
                 modulo="Registro de Usuario",
             )
+            db.session.commit()
+            invalidar_cache_reportes()
+            app.logger.debug("Usuario guardado en la base de datos.")
 
             flash("¡Tu cuenta ha sido creada con éxito! Ahora puedes iniciar sesión.", "success")
             return redirect(url_for("auth.login", usuario=nuevo_usuario.usuario))
@@ -134,21 +149,30 @@ def login():
         usuario_arg = request.args.get('usuario')
         if usuario_arg:
             form.usuario.data = usuario_arg
-    app.logger.debug("Datos recibidos del formulario: %s", {**form.data, "contrasenya": "[omitted]"})
+    # Se comprueba el nivel antes de copiar form.data para no pagar esa copia
+    # en cada login cuando DEBUG está desactivado.
+    if app.logger.isEnabledFor(logging.DEBUG):
+        app.logger.debug("Datos recibidos del formulario: %s", {**form.data, "contrasenya": "[omitted]"})
 
     if request.method == "POST" and _is_rate_limited():
         flash("Demasiados intentos de inicio de sesión. Intenta de nuevo en unos minutos.", "danger")
         return render_template("index.html", form=form), 429
 
     if form.validate_on_submit():
-        usuario = Usuario.query.filter_by(usuario=form.usuario.data).first()
+        # Búsqueda por la clave única (indexada) cargando sólo lo que usan la
+        # verificación y login_user; el resto de columnas queda diferido.
+        usuario = db.session.scalars(
+            select(Usuario)
+            .options(load_only(Usuario.id, Usuario.usuario, Usuario.rol, Usuario.contrasenya_hash))
+            .filter_by(usuario=form.usuario.data)
+        ).first()
 
         # Validamos la existencia antes de acceder a atributos para evitar AttributeError.
         if not usuario:
             flash("Usuario o contraseña incorrectos.", "danger")
             return render_template("index.html", form=form)
 
-        if usuario.check_contrasenya(form.contrasenya.data):
+        if Usuario.check_contrasenya(usuario.contrasenya_hash, form.contrasenya.data):
             session.clear()  # Evita fijación de sesión previa al login.
             login_user(usuario)
             _reset_rate_limit()
@@ -184,7 +208,7 @@ def logout():
 
 @auth_bp.route("/actividades", methods=["GET", "POST"])
 @login_required
-@role_required("admin")
+@admin_required
 def actividades():
     # Capturar mensajes de éxito o error desde la URL
     mensaje_exito = request.args.get("flash_success")
@@ -218,7 +242,13 @@ def actividades():
     if fecha_fin:
         fecha_fin = fecha_fin + timedelta(days=1)
 
-    act_query = ActividadUsuario.query.join(Usuario)
+    # El JOIN ya trae al usuario: se rellena la relación con esas columnas en
+    # lugar de lanzar una consulta por autor al pintar la tabla. En las tres
+    # tablas del panel sólo se cargan las columnas que pinta la plantilla.
+    act_query = ActividadUsuario.query.join(Usuario).options(
+        load_only(ActividadUsuario.id, ActividadUsuario.accion, ActividadUsuario.modulo, ActividadUsuario.fecha),
+        contains_eager(ActividadUsuario.usuario).load_only(Usuario.id, Usuario.usuario),
+    )
     if filtro_usuario:
         like = f"%{filtro_usuario}%"
         act_query = act_query.filter(Usuario.usuario.ilike(like))
@@ -232,7 +262,7 @@ def actividades():
 
     filtro_rol = (request.args.get("f_rol") or "").strip()
     filtro_busqueda = (request.args.get("f_q") or "").strip()
-    user_query = Usuario.query
+    user_query = Usuario.query.options(load_only(Usuario.id, Usuario.usuario, Usuario.nombre, Usuario.rol))
     if filtro_rol:
         user_query = user_query.filter(Usuario.rol == filtro_rol)
     if filtro_busqueda:
@@ -248,7 +278,7 @@ def actividades():
     if fecha_c_hasta:
         fecha_c_hasta = fecha_c_hasta + timedelta(days=1)
 
-    compras_query = Compra.query
+    compras_query = Compra.query.options(load_only(Compra.id, Compra.total, Compra.estado, Compra.fecha))
     if filtro_estado:
         compras_query = compras_query.filter(Compra.estado == filtro_estado)
     if fecha_c_desde:
@@ -281,7 +311,7 @@ def actividades():
 
 @auth_bp.route("/compras/export", methods=["GET"])
 @login_required
-@role_required("admin")
+@admin_required
 def exportar_compras_admin():
     """Exporta las compras del panel admin con filtros aplicados."""
 
@@ -294,55 +324,77 @@ def exportar_compras_admin():
     if fecha_hasta:
         fecha_hasta = fecha_hasta + timedelta(days=1)
 
-    compras_query = Compra.query
+    # Columnas planas con los nombres ya unidos: sin entidades ni cargas
+    # perezosas por fila, leídas y enviadas por lotes en lugar de todas de golpe.
+    compras_query = (
+        select(
+            Compra.id,
+            Usuario.usuario,
+            Compra.usuario_id,
+            Producto.modelo,
+            Compra.producto_id,
+            Proveedor.nombre,
+            Compra.proveedor_id,
+            Compra.cantidad,
+            Compra.precio_unitario,
+            Compra.total,
+            Compra.estado,
+            Compra.fecha,
+        )
+        .outerjoin(Usuario, Usuario.id == Compra.usuario_id)
+        .outerjoin(Producto, Producto.id == Compra.producto_id)
+        .outerjoin(Proveedor, Proveedor.id == Compra.proveedor_id)
+    )
     if filtro_estado:
-        compras_query = compras_query.filter(Compra.estado == filtro_estado)
+        compras_query = compras_query.where(Compra.estado == filtro_estado)
     if fecha_desde:
-        compras_query = compras_query.filter(Compra.fecha >= fecha_desde)
+        compras_query = compras_query.where(Compra.fecha >= fecha_desde)
     if fecha_hasta:
-        compras_query = compras_query.filter(Compra.fecha < fecha_hasta)
-
-    buffer = io.StringIO()
-    writer = csv.writer(buffer)
-    write_safe_csv_row(
-        writer,
-        [
-            "compra_id",
-            "usuario",
-            "producto",
-            "proveedor",
-            "cantidad",
-            "precio_unitario",
-            "total",
-            "estado",
-            "fecha",
-        ],
-    )
+        compras_query = compras_query.where(Compra.fecha < fecha_hasta)
 
-    for compra in compras_query.order_by(Compra.fecha.desc()).all():
-        write_safe_csv_row(
-            writer,
-            [
-                compra.id,
-                getattr(compra.usuario, "usuario", compra.usuario_id),
-                getattr(compra.producto, "modelo", compra.producto_id),
-                getattr(compra.proveedor, "nombre", compra.proveedor_id),
-                compra.cantidad,
-                f"{compra.precio_unitario}",
-                f"{compra.total}",
-                compra.estado,
-                compra.fecha.strftime("%Y-%m-%d %H:%M") if hasattr(compra, "fecha") else "",
-            ],
+    def _filas():
+        filas = db.session.execute(
+            compras_query.order_by(Compra.fecha.desc()).execution_options(yield_per=_EXPORT_BATCH)
         )
-
-    response = Response(buffer.getvalue(), mimetype="text/csv; charset=utf-8")
+        for (
+            compra_id, usuario, usuario_id, modelo, producto_id, proveedor, proveedor_id,
+            cantidad, precio_unitario, total, estado, fecha,
+        ) in filas:
+            yield [
+                compra_id,
+                usuario or usuario_id,
+                modelo or producto_id,
+                proveedor or proveedor_id,
+                cantidad,
+                f"{precio_unitario}",
+                f"{total}",
+                estado,
+                fecha.strftime("%Y-%m-%d %H:%M") if fecha else "",
+            ]
+
+    cabecera = [
+        "compra_id",
+        "usuario",
+        "producto",
+        "proveedor",
+        "cantidad",
+        "precio_unitario",
+        "total",
+        "estado",
+        "fecha",
+    ]
+    # La consulta se ejecuta dentro del generador: cada lote leído se escribe
+    # y se envía antes de pedir el siguiente.
+    response = Response(
+        stream_with_context(iter_safe_csv(cabecera, _filas(), _EXPORT_BATCH)), mimetype="text/csv; charset=utf-8"
+    )
     response.headers["Content-Disposition"] = "attachment; filename=compras_admin.csv"
     return response
 
 
 @auth_bp.route('/eliminar_usuario/<string:usuario_id>', methods=['POST'])
 @login_required
-@role_required("admin")
+@admin_required
 def eliminar_usuario(usuario_id):
     # Usamos session.get para alinearnos con SQLAlchemy 2.x y evitar warnings de API legacy.
     usuario = db.session.get(Usuario, usuario_id)
@@ -357,13 +409,13 @@ def eliminar_usuario(usuario_id):
 
     try:
         db.session.delete(usuario)
-        db.session.commit()
-
         registrar_actividad(
             usuario_id=current_user.id,
             accion=f"Eliminó al usuario {usuario.usuario} (ID: {usuario.id})",
             modulo="Gestión de Usuarios",
         )
+        db.session.commit()
+        invalidar_cache_reportes()
 
         flash("Usuario eliminado correctamente.", "success")
     except Exception as exc:  # pragma: no cover - logs y feedback de usuario
@@ -376,7 +428,7 @@ def eliminar_usuario(usuario_id):
 
 @auth_bp.route('/cambiar_rol/<string:usuario_id>', methods=['POST'])
 @login_required
-@role_required("admin")
+@admin_required
 def cambiar_rol(usuario_id):
     """Permite actualizar el rol desde la vista admin.
 
@@ -406,13 +458,12 @@ def cambiar_rol(usuario_id):
 
     try:
         usuario.rol = nuevo_rol
-        db.session.commit()
-
         registrar_actividad(
             usuario_id=current_user.id,
             accion=f"Cambió rol de {usuario.usuario} a {nuevo_rol}",
             modulo="Gestión de Usuarios",
         )
+        db.session.commit()
     except Exception as exc:  # pragma: no cover - logs y feedback de usuario
         db.session.rollback()
         return _responder(False, f"Error al actualizar el rol: {exc}", "danger", 500)
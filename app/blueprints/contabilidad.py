@@ -3,8 +3,9 @@ from flask_login import login_required, current_user
 from app.db import db
 from app.models import Asiento, Cuenta, Apunte
 from app.forms import AsientoManualForm
-from app.services.accounting_services import crear_asiento, inicializar_plan_cuentas, obtener_saldo_cuenta
+from app.services.accounting_services import crear_asiento, inicializar_plan_cuentas, obtener_saldos_cuentas
 from app.blueprints.helpers import write_safe_csv_row
+from app.blueprints.reportes import invalidar_cache_reportes
 import csv
 import io
 from datetime import datetime, timedelta
@@ -59,7 +60,7 @@ def balance():
         return redirect(url_for('menu.menu_principal'))
     
     cuentas = Cuenta.query.order_by(Cuenta.codigo).all()
-    saldos = {c.id: obtener_saldo_cuenta(c.id) for c in cuentas}
+    saldos = obtener_saldos_cuentas(cuentas)
     
     # Calcular totales por tipo
     totales = {'ACTIVO': 0, 'PASIVO': 0, 'PATRIMONIO': 0, 'INGRESO': 0, 'GASTO': 0}
@@ -79,23 +80,15 @@ def nuevo_asiento():
     
     if form.validate_on_submit():
         try:
-            apuntes_data = []
-            for apunte_form in form.apuntes:
-                # Filtrar entradas vacías si es necesario, aunque WTForms suele enviarlas
-                if apunte_form.cuenta_codigo.data:
-                    apuntes_data.append({
-                        'cuenta_codigo': apunte_form.cuenta_codigo.data,
-                        'debe': apunte_form.debe.data,
-                        'haber': apunte_form.haber.data
-                    })
-            
+            # El formulario ya descarta las líneas sin cuenta y normaliza importes.
             crear_asiento(
                 descripcion=form.descripcion.data,
                 usuario_id=current_user.id,
                 fecha=form.fecha.data,
-                apuntes_data=apuntes_data
+                apuntes_data=form.apuntes_data
             )
             db.session.commit()
+            invalidar_cache_reportes()
             flash('Asiento creado correctamente.', 'success')
             return redirect(url_for('contabilidad.diario'))
         except ValueError as e:
@@ -194,7 +187,7 @@ def exportar_balance():
         return redirect(url_for('menu.menu_principal'))
     
     cuentas = Cuenta.query.order_by(Cuenta.codigo).all()
-    saldos = {c.id: obtener_saldo_cuenta(c.id) for c in cuentas}
+    saldos = obtener_saldos_cuentas(cuentas)
     
     si = io.StringIO()
     cw = csv.writer(si)
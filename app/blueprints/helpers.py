@@ -4,12 +4,14 @@ Se centralizan validaciones y decoradores que antes vivían en `routes.py`
 para que cada módulo use la misma lógica sin duplicarla.
 """
 
+import csv
+import io
+import re
 from datetime import datetime, timezone
 from functools import wraps
 
-from flask import current_app, flash, redirect, url_for
+from flask import flash, redirect, url_for
 from flask_login import current_user
-from markupsafe import escape
 
 from ..db import db
 from ..models import ActividadUsuario
@@ -25,7 +27,9 @@ def role_required(role):
     def decorator(f):
         @wraps(f)
         def wrapped(*args, **kwargs):
-            if not current_user.is_authenticated or current_user.rol != role:
+            # El proxy de current_user se resuelve una sola vez por petición.
+            usuario = current_user._get_current_object()
+            if not usuario.is_authenticated or usuario.rol != role:
                 flash("Acceso denegado.", "danger")
                 # Redirigimos a la portada para evitar endpoints inexistentes.
                 return redirect(url_for("auth.root"))
@@ -36,24 +40,21 @@ def role_required(role):
     return decorator
 
 
+# Decoradores ya construidos para los dos roles de la aplicación.
+admin_required = role_required("admin")
+cliente_required = role_required("cliente")
+
+
 def registrar_actividad(usuario_id, accion, modulo):
-    """Persist activity logs with rollback seguro on failure.
+    """Añade la actividad a la transacción en curso, sin confirmarla.
 
-    Se conserva el mismo esquema de registro pero aislado para que cualquier
-    blueprint pueda auditar acciones sin crear importaciones circulares.
+    La vista la llama antes de su propio commit: la acción y su registro se
+    escriben juntos (un solo COMMIT) y, si la acción falla, tampoco queda
+    rastro de ella. Se mantiene aislada para que cualquier blueprint pueda
+    auditar sin crear importaciones circulares.
     """
 
-    try:
-        nueva_actividad = ActividadUsuario(
-            usuario_id=usuario_id,
-            accion=accion,
-            modulo=modulo,
-        )
-        db.session.add(nueva_actividad)
-        db.session.commit()
-    except Exception as exc:  # pragma: no cover - se loguea pero no rompe la UX
-        db.session.rollback()
-        current_app.logger.error("Error al registrar la actividad: %s", exc)
+    db.session.add(ActividadUsuario(usuario_id=usuario_id, accion=accion, modulo=modulo))
 
 
 def _sanitize_csv_value(value):
@@ -73,6 +74,25 @@ def write_safe_csv_row(writer, values):
     writer.writerow([_sanitize_csv_value(val) for val in values])
 
 
+def iter_safe_csv(cabecera, filas, lote):
+    """Genera un CSV saneado por trozos de ``lote`` filas.
+
+    El búfer se vacía tras cada trozo, así que junto con una respuesta en
+    streaming el fichero nunca está entero en memoria.
+    """
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    write_safe_csv_row(writer, cabecera)
+    for numero, fila in enumerate(filas, 1):
+        write_safe_csv_row(writer, fila)
+        if numero % lote == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
 def _period_key_and_label(moment: datetime, intervalo: str):
     """Agrupa fechas en Python para compatibilidad entre motores SQL.
 
@@ -116,6 +136,13 @@ def _extract_productos(source):
     return [raw]
 
 
+_CAMPOS_PROVEEDOR = ("nombre", "telefono", "direccion", "email", "cif", "tasa_de_descuento", "iva")
+
+
+# Porcentaje no negativo en notación decimal simple (0-100 se comprueba aparte).
+_PORCENTAJE_RE = re.compile(r"\d{1,3}(?:\.\d+)?")
+
+
 def validar_datos_proveedor(form):
     """Valida campos mínimos y convierte valores numéricos de proveedores.
 
@@ -123,29 +150,25 @@ def validar_datos_proveedor(form):
     proveedores reaprovechen la misma validación previa al commit.
     """
 
-    required_fields = ["nombre", "telefono", "direccion", "email", "cif", "tasa_de_descuento", "iva"]
-    for field in required_fields:
-        value = form.get(field)
+    # Cada campo se lee una sola vez del formulario y se reutiliza después.
+    datos = {campo: form.get(campo) for campo in _CAMPOS_PROVEEDOR}
+    for field, value in datos.items():
         if value is None or (isinstance(value, str) and not value.strip()):
             return False, f"El campo '{field}' es obligatorio."
 
-    try:
-        tasa_de_descuento = float(form.get("tasa_de_descuento"))
-        iva = float(form.get("iva"))
-    except (TypeError, ValueError):
+    # El patrón descarta de entrada lo que float() aceptaría pero no es un
+    # porcentaje ("inf", "nan", "1e3"...), sin pasar por try/except.
+    valores = [str(datos[campo]).strip() for campo in ("tasa_de_descuento", "iva")]
+    if not all(_PORCENTAJE_RE.fullmatch(valor) for valor in valores):
         return False, "Los campos 'Tasa de descuento' e 'IVA' deben ser números válidos."
+    tasa_de_descuento, iva = (float(valor) for valor in valores)
+    if tasa_de_descuento > 100 or iva > 100:
+        return False, "Los campos 'Tasa de descuento' e 'IVA' deben estar entre 0 y 100."
 
     productos = [item for item in _extract_productos(form) if item]
     productos_str = ", ".join(productos) if productos else "No especificado"
 
-    datos = {
-        "nombre": escape(form.get("nombre")),
-        "telefono": escape(form.get("telefono")),
-        "direccion": escape(form.get("direccion")),
-        "email": escape(form.get("email")),
-        "cif": escape(form.get("cif")),
-        "tasa_de_descuento": tasa_de_descuento,
-        "iva": iva,
-        "tipo_producto": productos_str,
-    }
+    # Los textos se guardan tal cual: SQLAlchemy parametriza las consultas y
+    # Jinja escapa al renderizar, así que escapar aquí producía doble escape.
+    datos.update(tasa_de_descuento=tasa_de_descuento, iva=iva, tipo_producto=productos_str)
     return True, datos
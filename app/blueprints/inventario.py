@@ -5,20 +5,27 @@ respecto a autenticación y reportes.
 """
 
 from decimal import Decimal, InvalidOperation
-from sqlalchemy import or_, and_
-from flask import abort, Blueprint, current_app as app, flash, redirect, render_template, request, url_for, session, Response
+from sqlalchemy import and_, bindparam, delete, insert, or_, select, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import joinedload, load_only
+from flask import abort, Blueprint, current_app as app, flash, redirect, render_template, request, url_for, session, Response, stream_with_context
 from flask_login import current_user, login_required, logout_user
 
 from ..db import db
 from ..forms import EditarPerfilForm
 from ..models import CestaDeCompra, Compra, Producto, Proveedor, ActividadUsuario, Usuario
-from .helpers import role_required, write_safe_csv_row
+from .helpers import admin_required, cliente_required, iter_safe_csv
+from .reportes import invalidar_cache_reportes
 from ..services.accounting_services import crear_asiento
 
 
 inventario_bp = Blueprint("inventario", __name__)
 DEFAULT_PAGE_SIZE = 20
 MAX_PAGE_SIZE = 50
+MAX_ALERTAS = 20
+# Filas leídas por lote en las exportaciones CSV.
+_EXPORT_BATCH = 1000
 
 
 def _parse_decimal(value: str | None):
@@ -30,6 +37,16 @@ def _parse_decimal(value: str | None):
         return None
 
 
+_ORDENES_PRODUCTO = {
+    'asc': Producto.modelo.asc(),
+    'desc': Producto.modelo.desc(),
+    'precio_asc': Producto.precio.asc(),
+    'precio_desc': Producto.precio.desc(),
+    'cantidad_asc': Producto.cantidad.asc(),
+    'cantidad_desc': Producto.cantidad.desc(),
+}
+
+
 def _build_productos_query(args):
     orden = args.get('orden', 'asc')
     q = (args.get('q') or "").strip()
@@ -74,18 +91,10 @@ def _build_productos_query(args):
     if precio_max is not None:
         query = query.filter(Producto.precio <= precio_max)
 
-    if orden == 'asc':
-        query = query.order_by(Producto.modelo.asc())
-    elif orden == 'desc':
-        query = query.order_by(Producto.modelo.desc())
-    elif orden == 'precio_asc':
-        query = query.order_by(Producto.precio.asc())
-    elif orden == 'precio_desc':
-        query = query.order_by(Producto.precio.desc())
-    elif orden == 'cantidad_asc':
-        query = query.order_by(Producto.cantidad.asc())
-    elif orden == 'cantidad_desc':
-        query = query.order_by(Producto.cantidad.desc())
+    if orden not in _ORDENES_PRODUCTO:
+        orden = 'asc'
+    # Producto.id desempata para que la paginación sea estable entre páginas.
+    query = query.order_by(_ORDENES_PRODUCTO[orden], Producto.id)
 
     filtros = {
         "q": q,
@@ -100,9 +109,29 @@ def _build_productos_query(args):
     return query, filtros
 
 
+def _alertas_stock():
+    """Productos en o bajo su mínimo, filtrados en SQL.
+
+    Antes se filtraba en Python sólo la página visible; ahora el aviso cubre
+    todo el catálogo, acotado a MAX_ALERTAS y con las columnas que pinta.
+    """
+    return (
+        Producto.query.options(
+            load_only(Producto.tipo_producto, Producto.marca, Producto.modelo, Producto.cantidad)
+        )
+        .filter(
+            Producto.cantidad_minima.isnot(None),
+            Producto.cantidad <= Producto.cantidad_minima,
+        )
+        .order_by(Producto.cantidad.asc(), Producto.id)
+        .limit(MAX_ALERTAS)
+        .all()
+    )
+
+
 @inventario_bp.route("/menu_principal", methods=["GET", "POST"])
 @login_required
-@role_required("admin")
+@admin_required
 def menu_principal():
     if current_user.is_authenticated and current_user.rol == "admin":
         alertas_stock_bajo = Producto.query.filter(
@@ -147,7 +176,7 @@ def menu_principal():
 
 @inventario_bp.route("/menu-cliente", methods=["GET", "POST"])
 @login_required
-@role_required("cliente")
+@cliente_required
 def menu_cliente():
     if current_user.is_authenticated and current_user.rol == "cliente":  # Verifica que el rol sea Cliente
         return render_template("menu-cliente.html")  # Renderiza el menú del cliente
@@ -155,7 +184,7 @@ def menu_cliente():
 
 @inventario_bp.route("/perfil_cliente", methods=["GET", "POST"])
 @login_required
-@role_required("cliente")
+@cliente_required
 def perfil_cliente():
     usuario = current_user
     form = EditarPerfilForm()
@@ -177,10 +206,10 @@ def perfil_cliente():
         new_pass = form.new_password.data
         if new_pass:
             current_pass = form.current_password.data
-            if not current_pass or not usuario.check_contrasenya(current_pass):
+            if not current_pass or not Usuario.check_contrasenya(usuario.contrasenya_hash, current_pass):
                 flash("La contraseña actual no es correcta.", "danger")
                 return redirect(url_for("inventario.perfil_cliente"))
-            usuario.hash_contrasenya(new_pass)
+            usuario.contrasenya_hash = Usuario.hash_contrasenya(new_pass)
 
         try:
             db.session.commit()
@@ -214,20 +243,18 @@ def perfil_cliente():
 
 @inventario_bp.route("/productos", methods=["GET", "POST"])
 @login_required
-@role_required("admin")
+@admin_required
 def productos():
     query, filtros = _build_productos_query(request.args)
     page = max(int(request.args.get("page", 1)), 1)
     per_page = min(int(request.args.get("page_size", DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
     pagination = query.paginate(page=page, per_page=per_page, error_out=False)
     productos = pagination.items
-    alertas = [
-        producto for producto in productos
-        if producto.cantidad_minima is not None
-        and producto.cantidad is not None
-        and producto.cantidad <= producto.cantidad_minima
-    ]
-    proveedores = Proveedor.query.all()
+    alertas = _alertas_stock()
+    # El desplegable del filtro sólo pinta id y nombre.
+    proveedores = (
+        Proveedor.query.options(load_only(Proveedor.id, Proveedor.nombre)).order_by(Proveedor.nombre).all()
+    )
     return render_template(
         'inventario_admin.html',
         productos=productos,
@@ -241,48 +268,39 @@ def productos():
 
 @inventario_bp.route('/productos/export', methods=['GET'])
 @login_required
-@role_required("admin")
+@admin_required
 def exportar_productos():
     query, _ = _build_productos_query(request.args)
-    productos = query.all()
-    import csv, io
-    si = io.StringIO()
-    cw = csv.writer(si)
-    write_safe_csv_row(cw, ['Tipo', 'Marca', 'Modelo', 'Descripcion', 'Precio', 'Cantidad', 'Proveedor'])
-    for p in productos:
-        write_safe_csv_row(
-            cw,
-            [
-                p.tipo_producto,
-                p.marca,
-                p.modelo,
-                p.descripcion,
-                p.precio,
-                p.cantidad,
-                p.proveedor_id,
-            ],
-        )
-    output = Response(si.getvalue(), mimetype='text/csv')
+    # Mismos filtros y orden que el listado, pero sólo las columnas del CSV,
+    # leídas por lotes y enviadas al cliente lote a lote: la memoria no crece
+    # con el tamaño del catálogo.
+    filas = query.with_entities(
+        Producto.tipo_producto,
+        Producto.marca,
+        Producto.modelo,
+        Producto.descripcion,
+        Producto.precio,
+        Producto.cantidad,
+        Producto.proveedor_id,
+    ).yield_per(_EXPORT_BATCH)
+    cabecera = ['Tipo', 'Marca', 'Modelo', 'Descripcion', 'Precio', 'Cantidad', 'Proveedor']
+    output = Response(
+        stream_with_context(iter_safe_csv(cabecera, filas, _EXPORT_BATCH)), mimetype='text/csv'
+    )
     output.headers['Content-Disposition'] = 'attachment; filename=productos.csv'
     return output
 
 
 @inventario_bp.route("/productos_cliente", methods=["GET", "POST"])
 @login_required
-@role_required("cliente")
+@cliente_required
 def productos_cliente():
     query, filtros = _build_productos_query(request.args)
     page = max(int(request.args.get("page", 1)), 1)
     per_page = min(int(request.args.get("page_size", DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
     pagination = query.paginate(page=page, per_page=per_page, error_out=False)
     productos = pagination.items
-    alertas = [
-        producto
-        for producto in productos
-        if producto.cantidad_minima is not None
-        and producto.cantidad is not None
-        and producto.cantidad <= producto.cantidad_minima
-    ]
+    alertas = _alertas_stock()
     return render_template(
         "productos-cliente.html",
         productos=productos,
@@ -292,9 +310,36 @@ def productos_cliente():
     )
 
 
+_UPSERT_INSERTS = {"sqlite": sqlite_insert, "postgresql": postgresql_insert}
+
+
+def _sumar_a_cesta(usuario_id, producto_id, cantidad):
+    """Suma ``cantidad`` a la línea de cesta del producto y devuelve el total.
+
+    En SQLite/PostgreSQL se usa un único INSERT ... ON CONFLICT DO UPDATE
+    sobre uq_cesta_usuario_producto, atómico frente a clics concurrentes.
+    """
+    upsert = _UPSERT_INSERTS.get(db.session.get_bind().dialect.name)
+    if upsert is None:
+        item = CestaDeCompra.query.filter_by(usuario_id=usuario_id, producto_id=producto_id).first()
+        if item:
+            item.cantidad += cantidad
+        else:
+            item = CestaDeCompra(usuario_id=usuario_id, producto_id=producto_id, cantidad=cantidad)
+            db.session.add(item)
+        return item.cantidad
+
+    stmt = upsert(CestaDeCompra).values(usuario_id=usuario_id, producto_id=producto_id, cantidad=cantidad)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[CestaDeCompra.usuario_id, CestaDeCompra.producto_id],
+        set_={"cantidad": CestaDeCompra.cantidad + stmt.excluded.cantidad},
+    ).returning(CestaDeCompra.cantidad)
+    return db.session.execute(stmt).scalar_one()
+
+
 @inventario_bp.route('/agregar_a_la_cesta/<producto_id>', methods=['POST'])
 @login_required
-@role_required("cliente")
+@cliente_required
 def agregar_a_la_cesta(producto_id):
     # db.session.get evita los warnings de la API legacy y permite controlar el 404 de forma explícita.
     producto = db.session.get(Producto, producto_id)
@@ -312,37 +357,38 @@ def agregar_a_la_cesta(producto_id):
         flash('La cantidad debe ser al menos 1.', 'warning')
         return redirect(url_for('inventario.productos_cliente'))
 
-    item_en_cesta = CestaDeCompra.query.filter_by(usuario_id=current_user.id, producto_id=producto.id).first()
+    cantidad_total = _sumar_a_cesta(current_user.id, producto.id, cantidad)
+    db.session.commit()
 
-    if item_en_cesta:
-        item_en_cesta.cantidad += cantidad
+    if cantidad_total > cantidad:
         flash(f'Se agregó {cantidad} más de {producto.modelo} a tu cesta', 'success')
     else:
-        nuevo_item = CestaDeCompra(usuario_id=current_user.id, producto_id=producto.id, cantidad=cantidad)
-        db.session.add(nuevo_item)
         flash(f'{producto.modelo} ha sido agregado a tu cesta', 'success')
-
-    db.session.commit()
     return redirect(url_for('inventario.productos_cliente'))
 
 
+def _items_de_cesta(usuario_id):
+    """Líneas de la cesta con su producto cargado en el mismo SELECT (sin N+1)."""
+    return (
+        CestaDeCompra.query.options(joinedload(CestaDeCompra.producto))
+        .filter_by(usuario_id=usuario_id)
+        .all()
+    )
+
+
 @inventario_bp.route("/cesta", methods=['POST', 'GET'])
 @login_required
-@role_required("cliente")
+@cliente_required
 def cesta():
-    items = CestaDeCompra.query.filter_by(usuario_id=current_user.id).all()
+    items = _items_de_cesta(current_user.id)
     total = sum(item.producto.precio * item.cantidad for item in items)
     return render_template('cesta.html', items=items, cesta_items=items, total=total)
 
 
 @inventario_bp.route('/actualizar_cesta/<item_id>', methods=['POST'])
 @login_required
-@role_required("cliente")
+@cliente_required
 def actualizar_cesta(item_id):
-    item = db.session.get(CestaDeCompra, item_id)
-    if not item:
-        abort(404, description="Elemento no encontrado en la cesta")
-
     try:
         nueva_cantidad = int(request.form.get('cantidad'))
     except (TypeError, ValueError):
@@ -353,7 +399,16 @@ def actualizar_cesta(item_id):
         flash('La cantidad debe ser al menos 1.', 'warning')
         return redirect(url_for('inventario.cesta'))
 
-    item.cantidad = nueva_cantidad
+    # El propietario forma parte del WHERE: una línea ajena no se toca y se
+    # responde igual que si no existiera.
+    resultado = db.session.execute(
+        update(CestaDeCompra)
+        .where(CestaDeCompra.id == item_id, CestaDeCompra.usuario_id == current_user.id)
+        .values(cantidad=nueva_cantidad)
+    )
+    if not resultado.rowcount:
+        db.session.rollback()
+        abort(404, description="Elemento no encontrado en la cesta")
     db.session.commit()
     flash('Cantidad actualizada.', 'success')
     return redirect(url_for('inventario.cesta'))
@@ -361,22 +416,23 @@ def actualizar_cesta(item_id):
 
 @inventario_bp.route('/eliminar_de_la_cesta/<item_id>', methods=['POST'])
 @login_required
-@role_required("cliente")
+@cliente_required
 def eliminar_de_la_cesta(item_id):
-    item = db.session.get(CestaDeCompra, item_id)
-
-    if item and item.usuario_id == current_user.id:
-        db.session.delete(item)
-        db.session.commit()
+    db.session.execute(
+        delete(CestaDeCompra).where(
+            CestaDeCompra.id == item_id, CestaDeCompra.usuario_id == current_user.id
+        )
+    )
+    db.session.commit()
 
     return redirect(url_for('inventario.cesta'))
 
 
 @inventario_bp.route('/confirmacion-de-compra', methods=['GET', 'POST'])
 @login_required
-@role_required("cliente")
+@cliente_required
 def confirmacion_de_compra():
-    cesta_items = CestaDeCompra.query.filter_by(usuario_id=current_user.id).all()
+    cesta_items = _items_de_cesta(current_user.id)
     total = sum(item.producto.precio * item.cantidad for item in cesta_items)
 
     return render_template('confirmacion-de-compra.html', cesta_items=cesta_items, total=total)
@@ -384,7 +440,7 @@ def confirmacion_de_compra():
 
 @inventario_bp.route('/confirmar-compra', methods=['POST'])
 @login_required
-@role_required("cliente")
+@cliente_required
 def confirmar_compra():
     direccion = (request.form.get('direccion') or "").strip()
     metodo_pago = (request.form.get('metodo_pago') or "").strip()
@@ -404,10 +460,29 @@ def confirmar_compra():
         return redirect(url_for('inventario.cesta'))
 
     try:
+        producto_ids = {item.producto_id for item in cesta_items}
+        # Un único SELECT ... IN bloqueando las filas de inventario hasta el
+        # commit, para que dos compras simultáneas no descuenten el mismo stock.
+        productos = {
+            producto.id: producto
+            for producto in Producto.query.filter(Producto.id.in_(producto_ids)).with_for_update()
+        }
+        # Sólo hace falta saber qué pedido pendiente ampliar: se leen los IDs
+        # sin hidratar filas y la suma se delega en un UPDATE posterior.
+        compras_pendientes = {}
+        for producto_id, compra_id in db.session.execute(
+            select(Compra.producto_id, Compra.id).where(
+                Compra.producto_id.in_(producto_ids),
+                Compra.usuario_id == current_user.id,
+                Compra.estado == "Pendiente",
+            )
+        ):
+            compras_pendientes.setdefault(producto_id, compra_id)
+
         pedidos = {}
 
         for item in cesta_items:
-            producto = db.session.get(Producto, item.producto_id)
+            producto = productos.get(item.producto_id)
             if not producto:
                 flash('Uno de los productos ya no está disponible.', 'warning')
                 return redirect(url_for('inventario.cesta'))
@@ -428,6 +503,8 @@ def confirmar_compra():
                 flash(f"No hay suficiente inventario para {data['producto'].modelo}", 'danger')
                 return redirect(url_for('inventario.cesta'))
 
+        nuevas_compras = []
+        ampliaciones = []
         for producto_id, data in pedidos.items():
             producto = data['producto']
             cantidad = data['cantidad']
@@ -437,30 +514,24 @@ def confirmar_compra():
 
             producto.cantidad -= cantidad
 
-            compra_existente = Compra.query.filter_by(
-                producto_id=producto_id,
-                usuario_id=current_user.id,
-                estado="Pendiente",
-            ).first()
+            compra_existente = compras_pendientes.get(producto_id)
 
             if compra_existente:
-                compra_existente.cantidad += cantidad
-                compra_existente.total += total
+                ampliaciones.append({'b_id': compra_existente, 'b_cantidad': cantidad, 'b_total': total})
                 # Nota: No actualizamos asientos de compras existentes para simplificar,
                 # idealmente cada compra debería ser única o generar su propio asiento.
                 # Asumiremos que se crea un asiento por el delta.
                 # Para simplificar, crearemos asiento por el total añadido.
             else:
-                nueva_compra = Compra(
-                    producto_id=producto_id,
-                    usuario_id=current_user.id,
-                    cantidad=cantidad,
-                    precio_unitario=precio_unitario,
-                    proveedor_id=proveedor_id,
-                    total=total,
-                    estado="Pendiente"
-                )
-                db.session.add(nueva_compra)
+                nuevas_compras.append({
+                    'producto_id': producto_id,
+                    'usuario_id': current_user.id,
+                    'cantidad': cantidad,
+                    'precio_unitario': precio_unitario,
+                    'proveedor_id': proveedor_id,
+                    'total': total,
+                    'estado': "Pendiente",
+                })
             
             # --- Contabilidad ---
             # 1. Ingreso por Venta
@@ -489,10 +560,28 @@ def confirmar_compra():
                     ]
                 )
 
-        for item in cesta_items:
-            db.session.delete(item)
+        # Altas, ampliaciones de pedidos pendientes y vaciado de la cesta en
+        # bloque: INSERT y UPDATE executemany y un DELETE ... IN en lugar de
+        # una sentencia por fila.
+        if nuevas_compras:
+            db.session.execute(insert(Compra), nuevas_compras)
+        if ampliaciones:
+            compras = Compra.__table__
+            db.session.execute(
+                update(compras)
+                .where(compras.c.id == bindparam('b_id'))
+                .values(
+                    cantidad=compras.c.cantidad + bindparam('b_cantidad'),
+                    total=compras.c.total + bindparam('b_total'),
+                ),
+                ampliaciones,
+            )
+        db.session.execute(
+            delete(CestaDeCompra).where(CestaDeCompra.id.in_([item.id for item in cesta_items]))
+        )
 
         db.session.commit()
+        invalidar_cache_reportes()
 
         flash('Compra realizada con éxito', 'success')
         return redirect(url_for('inventario.pedidos'))
@@ -505,12 +594,21 @@ def confirmar_compra():
 
 @inventario_bp.route("/pedidos", methods=["GET"])
 @login_required
-@role_required("cliente")
+@cliente_required
 def pedidos():
     page = max(int(request.args.get("page", 1)), 1)
     per_page = min(int(request.args.get("page_size", DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+    # El producto llega en el mismo SELECT (JOIN) con sólo las columnas que
+    # pinta la plantilla; sin ello cada fila dispara su propia consulta.
     pagination = (
-        Compra.query.filter_by(usuario_id=current_user.id)
+        Compra.query.options(
+            load_only(
+                Compra.id, Compra.cantidad, Compra.precio_unitario,
+                Compra.total, Compra.estado, Compra.fecha,
+            ),
+            joinedload(Compra.producto).load_only(Producto.modelo),
+        )
+        .filter_by(usuario_id=current_user.id)
         .filter(Compra.estado != "Cancelado")
         .order_by(Compra.fecha.desc())
         .paginate(page=page, per_page=per_page, error_out=False)
@@ -520,11 +618,18 @@ def pedidos():
 
 @inventario_bp.route('/cancelar_pedido/<pedido_id>', methods=['POST'])
 @login_required
-@role_required("cliente")
+@cliente_required
 def cancelar_pedido(pedido_id):
-    pedido = db.session.get(Compra, pedido_id)
+    # Propietario y estado se filtran en SQL y la fila queda bloqueada hasta
+    # el commit: un segundo envío (otra pestaña) ya no la encuentra pendiente
+    # y no devuelve el stock dos veces.
+    pedido = (
+        Compra.query.filter_by(id=pedido_id, usuario_id=current_user.id, estado="Pendiente")
+        .with_for_update()
+        .first()
+    )
 
-    if not pedido or pedido.usuario_id != current_user.id:
+    if not pedido:
         flash('Pedido no encontrado o no tienes permiso para cancelarlo', 'danger')
         return redirect(url_for('inventario.pedidos'))
 
@@ -561,6 +666,7 @@ def cancelar_pedido(pedido_id):
         pedido.estado = "Cancelado"
 
         db.session.commit()
+        invalidar_cache_reportes()
         flash('Pedido cancelado y cantidad devuelta al inventario', 'success')
     except Exception:
         db.session.rollback()
@@ -4,10 +4,15 @@ Se separa del resto para aislar validaciones y altas/ediciones de
 inventario respecto a otras áreas de la app.
 """
 
+import hashlib
+import json
+import logging
 from decimal import Decimal, InvalidOperation
+from types import MappingProxyType
 from flask import abort, Blueprint, current_app as app, flash, jsonify, redirect, render_template, request, url_for, Response
 from flask_login import current_user, login_required
-from sqlalchemy import or_
+from sqlalchemy import delete, exists, or_, select
+from sqlalchemy.orm import selectinload
 import csv
 import io
 
@@ -15,43 +20,60 @@ DEFAULT_PAGE_SIZE = 20
 MAX_PAGE_SIZE = 50
 from ..db import db
 from ..forms import AgregarProductoForm, ProveedorForm
-from ..models import Producto, Proveedor
-from .helpers import registrar_actividad, validar_datos_proveedor, role_required, write_safe_csv_row
+from ..models import CestaDeCompra, Compra, Producto, Proveedor, ProveedorTipo, proveedor_tipo_producto
+from .helpers import admin_required, registrar_actividad, validar_datos_proveedor, write_safe_csv_row
+from .reportes import invalidar_cache_reportes
 from ..services.accounting_services import crear_asiento
 
 
 proveedores_bp = Blueprint("proveedores", __name__)
 
+def _tipos_producto_de(proveedor_id):
+    """Lista de tipos del proveedor, o None si no existe."""
+    # El LEFT JOIN distingue "proveedor sin tipos" (una fila con None) de
+    # "proveedor inexistente" (ninguna fila) en una sola consulta.
+    filas = db.session.execute(
+        select(ProveedorTipo.tipo)
+        .select_from(Proveedor)
+        .outerjoin(ProveedorTipo, ProveedorTipo.proveedor_id == Proveedor.id)
+        .where(Proveedor.id == proveedor_id)
+        .order_by(ProveedorTipo.tipo)
+    ).scalars().all()
+    if not filas:
+        return None
+    return [tipo for tipo in filas if tipo is not None]
+
 
 @proveedores_bp.route('/tipos-producto/<proveedor_id>', methods=['GET'])
 @login_required
-@role_required("admin")
+@admin_required
 def obtener_tipos_producto(proveedor_id):
     try:
-        proveedor = Proveedor.query.filter_by(id=proveedor_id).first()
-        if not proveedor:
+        tipos_producto = _tipos_producto_de(proveedor_id)
+        if tipos_producto is None:
             return jsonify({'error': 'Proveedor no encontrado'}), 404
 
-        tipos_producto = proveedor.tipo_producto.split(',') if proveedor.tipo_producto else []
-        return jsonify({'tipos_producto': tipos_producto})
+        return _respuesta_json_constante(*_json_constante({'tipos_producto': tipos_producto}))
     except Exception as exc:  # pragma: no cover - feedback JSON
         return jsonify({'error': str(exc)}), 500
 
 
 @proveedores_bp.route('/proveedor/<proveedor_id>', methods=['GET'])
 @login_required
-@role_required("admin")
+@admin_required
 def obtener_proveedor(proveedor_id):
     try:
-        proveedor = Proveedor.query.filter_by(id=proveedor_id).first()
-        if not proveedor:
+        cif = db.session.scalar(select(Proveedor.cif).filter_by(id=proveedor_id))
+        if cif is None:
             return jsonify({'error': 'Proveedor no encontrado'}), 404
 
-        return jsonify({'cif': proveedor.cif})
+        return _respuesta_json_constante(*_json_constante({'cif': cif}))
     except Exception as exc:  # pragma: no cover - feedback JSON
         return jsonify({'error': str(exc)}), 500
 
 
+# Catálogos de sólo lectura: los JSON precalculados se derivan de ellos al
+# importar, así que ninguna vista debe poder modificarlos después.
 MARCAS = {
     'Procesador': ['Intel', 'AMD', 'Qualcomm', 'ARM', 'Apple'],
     'Placa Base': ['Asus', 'Gigabyte', 'MSI', 'ASRock', 'Biostar'],
@@ -61,17 +83,54 @@ MARCAS = {
     'RAM': ['Kingston', 'Corsair', 'G.Skill', 'Crucial', 'Patriot'],
     'Tarjeta Gráfica': ['NVIDIA', 'AMD', 'ASUS', 'EVGA', 'ZOTAC'],
 }
+MARCAS = MappingProxyType({tipo: tuple(marcas) for tipo, marcas in MARCAS.items()})
+
+
+def _json_constante(payload):
+    """Serializa el payload y calcula su ETag (una sola vez si es fijo)."""
+    body = json.dumps(payload).encode("utf-8")
+    return body, hashlib.sha1(body).hexdigest()
+
+
+# Los catálogos sólo cambian con un despliegue: el navegador puede reutilizarlos
+# una hora sin preguntar. Son privados porque las rutas exigen sesión.
+_CATALOGO_MAX_AGE = 3600
+
+
+def _respuesta_json_constante(body, etag, max_age=None):
+    """Respuesta JSON precalculada que contesta 304 si el cliente ya la tiene.
+
+    Sin ``max_age`` el navegador debe revalidar siempre (``no-cache``), lo
+    que con el ETag cuesta un 304 vacío cuando los datos no han cambiado.
+    """
+    response = Response(body, mimetype="application/json")
+    response.set_etag(etag)
+    response.cache_control.private = True
+    if max_age is None:
+        response.cache_control.no_cache = True
+    else:
+        response.cache_control.max_age = max_age
+    return response.make_conditional(request)
+
+
+# Los catálogos son constantes del módulo: el JSON de cada tipo se genera al
+# importar y las peticiones sólo hacen un lookup en el diccionario.
+_MARCAS_JSON = {
+    tipo: _json_constante([{'id': idx, 'nombre': marca} for idx, marca in enumerate(marcas)])
+    for tipo, marcas in MARCAS.items()
+}
+_MARCAS_VACIAS_JSON = _json_constante([])
 
 
 @proveedores_bp.route('/get_marcas', methods=['GET'])
 @login_required
-@role_required("admin")
+@admin_required
 def get_marcas():
     tipo_producto = request.args.get('tipo_producto')
     app.logger.debug("Tipo de producto recibido: %s", tipo_producto)
-    marcas = MARCAS.get(tipo_producto, [])
-    marcas_json = [{'id': idx, 'nombre': marca} for idx, marca in enumerate(marcas)]
-    return jsonify(marcas_json)
+    return _respuesta_json_constante(
+        *_MARCAS_JSON.get(tipo_producto, _MARCAS_VACIAS_JSON), max_age=_CATALOGO_MAX_AGE
+    )
 
 
 MARCAS_Y_MODELOS = {
@@ -137,21 +196,28 @@ MARCAS_Y_MODELOS = {
                   'ZOTAC Mini RTX 3050', 'ZOTAC GT 1030'],
     },
 }
+MARCAS_Y_MODELOS = MappingProxyType({
+    tipo: MappingProxyType({marca: tuple(modelos) for marca, modelos in marcas.items()})
+    for tipo, marcas in MARCAS_Y_MODELOS.items()
+})
+
+_MODELOS_JSON = {
+    (tipo, marca): _json_constante([{"id": idx, "modelo": modelo} for idx, modelo in enumerate(modelos)])
+    for tipo, marcas in MARCAS_Y_MODELOS.items()
+    for marca, modelos in marcas.items()
+}
+
 
-PROVEEDOR_PRODUCTOS = [
+PROVEEDOR_PRODUCTOS = (
     "Ordenador",
     "Tarjeta Gráfica",
     "Procesador",
     "Fuente",
     "Disco Duro",
     "RAM",
-]
-
-
-def _split_tipo_producto(value: str) -> list[str]:
-    if not value or value.strip().lower() == "no especificado":
-        return []
-    return [item.strip() for item in value.split(",") if item.strip()]
+)
+# Opciones del checkbox múltiple construidas una vez; el formulario sólo las lee.
+_PROVEEDOR_PRODUCTOS_CHOICES = tuple((opcion, opcion) for opcion in PROVEEDOR_PRODUCTOS)
 
 
 def _render_proveedor_template(template, form, proveedor=None):
@@ -159,7 +225,7 @@ def _render_proveedor_template(template, form, proveedor=None):
 
 
 def _hydrate_proveedor_form(form):
-    form.productos.choices = [(opcion, opcion) for opcion in PROVEEDOR_PRODUCTOS]
+    form.productos.choices = _PROVEEDOR_PRODUCTOS_CHOICES
     return form
 
 
@@ -173,29 +239,30 @@ def _flash_form_errors(form):
 
 @proveedores_bp.route("/get_modelos", methods=["GET"])
 @login_required
-@role_required("admin")
+@admin_required
 def get_modelos():
     tipo_producto = request.args.get("tipo_producto")
     marca = request.args.get("marca")
 
-    if tipo_producto in MARCAS_Y_MODELOS and marca in MARCAS_Y_MODELOS[tipo_producto]:
-        modelos = MARCAS_Y_MODELOS[tipo_producto][marca]
-        modelos_json = [{"id": idx, "modelo": modelo} for idx, modelo in enumerate(modelos)]
-        return jsonify(modelos_json)
+    modelos_json = _MODELOS_JSON.get((tipo_producto, marca))
+    if modelos_json:
+        return _respuesta_json_constante(*modelos_json, max_age=_CATALOGO_MAX_AGE)
 
     return jsonify({"error": "No hay modelos disponibles"}), 404
 
 
 @proveedores_bp.route("/agregar-producto", methods=["GET", "POST"])
 @login_required
-@role_required("admin")
+@admin_required
 def agregar_producto():
     proveedores = Proveedor.query.all()
     form = AgregarProductoForm()
 
     if form.validate_on_submit():
         try:
-            proveedor = Proveedor.query.filter_by(id=form.proveedor_id.data).first()
+            # Los proveedores ya están en el identity map por la consulta de
+            # arriba, así que session.get no emite SQL adicional.
+            proveedor = db.session.get(Proveedor, form.proveedor_id.data)
             if not proveedor:
                 flash("El proveedor seleccionado no existe", "error")
                 return render_template("agregar-producto.html", proveedores=proveedores, form=form)
@@ -228,13 +295,13 @@ def agregar_producto():
                     ]
                 )
 
-            db.session.commit()
-
             registrar_actividad(
                 usuario_id=current_user.id,
                 accion=f"Se añadió producto: {nuevo_producto.modelo} con ID {nuevo_producto.id}",
                 modulo="Gestión de Productos",
             )
+            db.session.commit()
+            invalidar_cache_reportes()
 
             app.logger.info("Producto %s creado por %s", nuevo_producto.id, current_user.id)
             flash("Producto agregado con éxito", "success")
@@ -258,14 +325,18 @@ def agregar_producto():
 
 @proveedores_bp.route("/editar_producto/<string:id>", methods=["GET", "POST"])
 @login_required
-@role_required("admin")
+@admin_required
 def editar_producto(id):
     # db.session.get evita la API legacy y nos permite controlar el 404 manualmente.
     producto = db.session.get(Producto, id)
     if not producto:
         abort(404, description="Producto no encontrado")
 
-    proveedor = db.session.get(Proveedor, producto.proveedor_id) if producto.proveedor_id else None
+    def _render():
+        # El proveedor sólo se muestra en el formulario: un POST correcto
+        # redirige sin llegar a consultarlo.
+        proveedor = db.session.get(Proveedor, producto.proveedor_id) if producto.proveedor_id else None
+        return render_template("editar_producto.html", producto=producto, proveedor=proveedor)
 
     if request.method == "POST":
         descripcion = (request.form.get("descripcion") or "").strip()
@@ -278,11 +349,11 @@ def editar_producto(id):
             costo = Decimal(request.form.get("costo", producto.costo))
         except (TypeError, ValueError, InvalidOperation):
             flash("Datos numéricos inválidos en el producto.", "danger")
-            return render_template("editar_producto.html", producto=producto, proveedor=proveedor)
+            return _render()
 
         if cantidad < 0 or cantidad_minima < 0 or precio < 0 or costo < 0:
             flash("Cantidad, mínimo, precio y costo deben ser valores positivos.", "warning")
-            return render_template("editar_producto.html", producto=producto, proveedor=proveedor)
+            return _render()
 
         producto.descripcion = descripcion
         producto.cantidad = cantidad
@@ -291,45 +362,51 @@ def editar_producto(id):
         producto.costo = costo
         producto.num_referencia = num_referencia
 
-        db.session.commit()
-
         registrar_actividad(
             usuario_id=current_user.id,
             accion=f"Editó el producto {producto.id}",
             modulo="Gestión de Productos",
         )
+        db.session.commit()
 
         flash("Producto actualizado correctamente", "success")
         return redirect(url_for("inventario.productos"))
 
-    return render_template("editar_producto.html", producto=producto, proveedor=proveedor)
+    return _render()
 
 
 @proveedores_bp.route("/eliminar_producto/<string:id>", methods=["POST"])
 @login_required
-@role_required("admin")
+@admin_required
 def eliminar_producto(id):
-    producto = db.session.get(Producto, id)
-    if not producto:
+    # Sólo el modelo para la actividad; el borrado va directo por SQL sin
+    # hidratar el producto ni sus colecciones (cesta, compras, proveedores).
+    modelo = db.session.scalar(select(Producto.modelo).filter_by(id=id))
+    if modelo is None:
         abort(404, description="Producto no encontrado")
-    if producto:
-        db.session.delete(producto)
-        db.session.commit()
+    # Las compras conservan el historial de ventas: no se dejan huérfanas.
+    if db.session.scalar(select(exists().where(Compra.producto_id == id))):
+        flash("No se puede eliminar un producto con compras registradas.", "warning")
+        return redirect(url_for("inventario.productos"))
 
-        registrar_actividad(
-            usuario_id=current_user.id,
-            accion=f"Eliminó el producto {producto.modelo} con ID {producto.id}",
-            modulo="Gestión de Productos",
-        )
+    db.session.execute(delete(CestaDeCompra).where(CestaDeCompra.producto_id == id))
+    db.session.execute(delete(proveedor_tipo_producto).where(proveedor_tipo_producto.c.producto_id == id))
+    db.session.execute(delete(Producto).where(Producto.id == id))
+    registrar_actividad(
+        usuario_id=current_user.id,
+        accion=f"Eliminó el producto {modelo} con ID {id}",
+        modulo="Gestión de Productos",
+    )
+    db.session.commit()
+    invalidar_cache_reportes()
 
-        flash("Producto eliminado correctamente", "success")
-        return redirect(url_for("inventario.productos"))
-    return "Producto no encontrado", 404
+    flash("Producto eliminado correctamente", "success")
+    return redirect(url_for("inventario.productos"))
 
 
 @proveedores_bp.route("/proveedores", methods=["GET", "POST"])
 @login_required
-@role_required("admin")
+@admin_required
 def proveedores():
     app.logger.debug("Entrando en /proveedores")
     q = (request.args.get("q") or "").strip()
@@ -337,7 +414,8 @@ def proveedores():
     page = max(int(request.args.get("page", 1)), 1)
     per_page = min(int(request.args.get("page_size", DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
 
-    query = Proveedor.query
+    # Los tipos se cargan en bloque: la plantilla y el CSV los muestran por fila.
+    query = Proveedor.query.options(selectinload(Proveedor.tipos))
     if q:
         like = f"%{q}%"
         query = query.filter(
@@ -348,11 +426,12 @@ def proveedores():
             )
         )
     if tipo:
-        query = query.filter(Proveedor.tipo_producto.ilike(f"%{tipo}%"))
+        query = query.filter(Proveedor.tipos.any(ProveedorTipo.tipo.ilike(f"%{tipo}%")))
 
     pagination = query.order_by(Proveedor.nombre.asc()).paginate(page=page, per_page=per_page, error_out=False)
     proveedores_list = pagination.items
-    app.logger.debug("Proveedores recuperados: %s", [p.id for p in proveedores_list])
+    if app.logger.isEnabledFor(logging.DEBUG):
+        app.logger.debug("Proveedores recuperados: %s", [p.id for p in proveedores_list])
     return render_template(
         "proveedores.html",
         proveedores=proveedores_list,
@@ -363,12 +442,12 @@ def proveedores():
 
 @proveedores_bp.route('/proveedores/export', methods=['GET'])
 @login_required
-@role_required("admin")
+@admin_required
 def exportar_proveedores():
     q = (request.args.get("q") or "").strip()
     tipo = (request.args.get("tipo") or "").strip()
 
-    query = Proveedor.query
+    query = Proveedor.query.options(selectinload(Proveedor.tipos))
     if q:
         like = f"%{q}%"
         query = query.filter(
@@ -379,7 +458,7 @@ def exportar_proveedores():
             )
         )
     if tipo:
-        query = query.filter(Proveedor.tipo_producto.ilike(f"%{tipo}%"))
+        query = query.filter(Proveedor.tipos.any(ProveedorTipo.tipo.ilike(f"%{tipo}%")))
 
     proveedores_list = query.order_by(Proveedor.nombre.asc()).all()
     si = io.StringIO()
@@ -407,7 +486,7 @@ def exportar_proveedores():
 
 @proveedores_bp.route('/agregar-proveedor', methods=['GET', 'POST'])
 @login_required
-@role_required("admin")
+@admin_required
 def agregar_proveedor():
     app.logger.debug("Payload recibido para proveedor: %s", request.form)
 
@@ -423,13 +502,13 @@ def agregar_proveedor():
         try:
             nuevo_proveedor = Proveedor(**datos_o_error)
             db.session.add(nuevo_proveedor)
-            db.session.commit()
-
+            db.session.flush()  # ID del proveedor para la actividad
             registrar_actividad(
                 usuario_id=current_user.id,
                 accion=f"Añadió al Proveedor {nuevo_proveedor.nombre} con ID {nuevo_proveedor.id}",
                 modulo="Gestión de Proveedores",
             )
+            db.session.commit()
 
             flash('Proveedor registrado exitosamente.', 'success')
             return redirect(url_for('proveedores.proveedores'))
@@ -446,7 +525,7 @@ def agregar_proveedor():
 
 @proveedores_bp.route('/editar_proveedor/<string:proveedor_id>', methods=['GET', 'POST'])
 @login_required
-@role_required("admin")
+@admin_required
 def editar_proveedor(proveedor_id):
     proveedor = db.session.get(Proveedor, proveedor_id)
     if not proveedor:
@@ -454,7 +533,7 @@ def editar_proveedor(proveedor_id):
 
     form = _hydrate_proveedor_form(ProveedorForm(obj=proveedor))
     if request.method == 'GET':
-        form.productos.data = _split_tipo_producto(proveedor.tipo_producto)
+        form.productos.data = [tipo.tipo for tipo in proveedor.tipos]
 
     if form.validate_on_submit():
         valido, datos_o_error = validar_datos_proveedor(form.data)
@@ -472,13 +551,12 @@ def editar_proveedor(proveedor_id):
             proveedor.iva = Decimal(datos_o_error['iva'])
             proveedor.tipo_producto = datos_o_error['tipo_producto']
 
-            db.session.commit()
-
             registrar_actividad(
                 usuario_id=current_user.id,
                 accion=f"Editó el producto {proveedor.nombre} con ID {proveedor.id}",
                 modulo="Gestión de Productos",
             )
+            db.session.commit()
 
             flash('Proveedor actualizado exitosamente.', 'success')
             return redirect(url_for('proveedores.proveedores'))
@@ -494,25 +572,33 @@ def editar_proveedor(proveedor_id):
 
 @proveedores_bp.route("/eliminar_proveedor/<string:id>", methods=["POST"])
 @login_required
-@role_required("admin")
+@admin_required
 def eliminar_proveedor(id):
-    proveedor = db.session.get(Proveedor, id)
-    if not proveedor:
+    nombre = db.session.scalar(select(Proveedor.nombre).filter_by(id=id))
+    if nombre is None:
         abort(404, description="Proveedor no encontrado")
-    db.session.delete(proveedor)
-    db.session.commit()
-
+    # Productos y compras apuntan al proveedor con FK obligatoria.
+    if db.session.scalar(
+        select(exists().where(Producto.proveedor_id == id) | exists().where(Compra.proveedor_id == id))
+    ):
+        flash("No se puede eliminar un proveedor con productos o compras asociados.", "warning")
+        return redirect(url_for("proveedores.proveedores"))
+
+    db.session.execute(delete(ProveedorTipo).where(ProveedorTipo.proveedor_id == id))
+    db.session.execute(delete(proveedor_tipo_producto).where(proveedor_tipo_producto.c.proveedor_id == id))
+    db.session.execute(delete(Proveedor).where(Proveedor.id == id))
     registrar_actividad(
         usuario_id=current_user.id,
-        accion=f"Eliminó el proveedor {proveedor.nombre} con ID {proveedor.id}",
+        accion=f"Eliminó el proveedor {nombre} con ID {id}",
         modulo="Gestión de Proveedores",
     )
+    db.session.commit()
     return redirect(url_for("proveedores.proveedores"))
 
 
 @proveedores_bp.route("/reponer_stock/<string:id>", methods=["GET", "POST"])
 @login_required
-@role_required("admin")
+@admin_required
 def reponer_stock(id):
     producto = db.session.get(Producto, id)
     if not producto:
@@ -547,13 +633,13 @@ def reponer_stock(id):
                 ]
             )
             
-            db.session.commit()
-            
             registrar_actividad(
                 usuario_id=current_user.id,
                 accion=f"Repuso stock de {producto.modelo}: +{cantidad_nueva} u. a {costo_nuevo} €/u. Nuevo PMP: {nuevo_pmp}",
                 modulo="Gestión de Inventario",
             )
+            db.session.commit()
+            invalidar_cache_reportes()
             
             flash(f"Stock actualizado. Nuevo costo promedio: {nuevo_pmp} €", "success")
             return redirect(url_for("inventario.productos"))
@@ -1,11 +1,12 @@
 """Blueprint de reportes y endpoints de datos agregados."""
 
 import csv
+import hashlib
 import json
 import logging
 import os
 from collections import defaultdict
-from datetime import datetime, timezone, timedelta
+from datetime import date, datetime, timezone, timedelta
 from io import StringIO
 from pathlib import Path
 from flask import Blueprint, Response, abort, current_app, jsonify, render_template, request, redirect, url_for
@@ -14,7 +15,7 @@ from sqlalchemy import func, case
 
 from ..db import db
 from ..models import Compra, Producto, Usuario, CacheEvent, Cuenta, Apunte, Asiento
-from .helpers import _period_key_and_label, role_required, write_safe_csv_row
+from .helpers import _period_key_and_label, admin_required, cliente_required, write_safe_csv_row
 
 
 reportes_bp = Blueprint("reportes", __name__)
@@ -247,15 +248,36 @@ def _cache_set(key: str, data):
     }
 
 
+def invalidar_cache_reportes():
+    """Vacía la caché de gráficas tras una escritura que cambia sus datos.
+
+    Las vistas que registran compras, productos, usuarios o asientos la
+    llaman después del commit para no servir datos obsoletos hasta el TTL.
+    """
+    if _CACHE:
+        _logger.info("cache-invalidate entries=%s", len(_CACHE))
+        _CACHE.clear()
+
+
+def _respuesta_json(cuerpo: bytes, etag: str):
+    """Respuesta JSON con ETag: si el navegador ya tiene esa versión, 304 sin cuerpo."""
+    response = Response(cuerpo, mimetype=current_app.json.mimetype)
+    response.set_etag(etag)
+    return response.make_conditional(request)
+
+
 def _cached_json(key: str, builder):
-    payload = _cache_get(key)
-    if payload is not None:
+    # Se cachea el JSON ya serializado junto a su ETag: los aciertos no
+    # vuelven a serializar y los sondeos del panel sin cambios reciben 304.
+    entrada = _cache_get(key)
+    if entrada is not None:
         _logger.info("cache-hit endpoint=%s hits=%s misses=%s", key, _CACHE_STATS["hits"], _CACHE_STATS["misses"])
-        return jsonify(payload)
-    payload = builder()
-    _cache_set(key, payload)
+        return _respuesta_json(*entrada)
+    cuerpo = current_app.json.dumps(builder()).encode("utf-8")
+    entrada = (cuerpo, hashlib.sha1(cuerpo).hexdigest())
+    _cache_set(key, entrada)
     _logger.info("cache-miss endpoint=%s hits=%s misses=%s", key, _CACHE_STATS["hits"], _CACHE_STATS["misses"])
-    return jsonify(payload)
+    return _respuesta_json(*entrada)
 
 
 
@@ -272,7 +294,7 @@ def index():
 
 @reportes_bp.route("/data/cache_stats")
 @login_required
-@role_required("admin")
+@admin_required
 def cache_stats():
     """Expone métricas simples de cache para monitoreo manual."""
     return jsonify({
@@ -285,7 +307,7 @@ def cache_stats():
 
 @reportes_bp.route("/data/cache_history")
 @login_required
-@role_required("admin")
+@admin_required
 def cache_history():
     """Devuelve los eventos recientes registrados en la caché con paginación."""
     try:
@@ -314,7 +336,7 @@ def cache_history():
 
 @reportes_bp.route("/data/cache_history/export")
 @login_required
-@role_required("admin")
+@admin_required
 def cache_history_export():
     """Permite descargar el historial persistente en un archivo JSON."""
     include_archives = str(request.args.get("include_archives", "0")).lower() in {"1", "true", "yes"}
@@ -328,7 +350,7 @@ def cache_history_export():
 
 @reportes_bp.route("/data/chart_export/<string:chart_name>")
 @login_required
-@role_required("admin")
+@admin_required
 def chart_export(chart_name):
     """Genera un CSV con los datos de una gráfica."""
     chart = _CHART_EXPORTERS.get(chart_name)
@@ -358,7 +380,7 @@ def chart_export(chart_name):
 
 @reportes_bp.route("/data/chart_export_cliente/<string:chart_name>")
 @login_required
-@role_required("cliente")
+@cliente_required
 def chart_export_cliente(chart_name):
     """Genera un CSV con los datos de una gráfica de cliente."""
     exporters = {
@@ -398,7 +420,7 @@ def chart_export_cliente(chart_name):
 
 @reportes_bp.route("/data/cache_ttl", methods=["POST"])
 @login_required
-@role_required("admin")
+@admin_required
 def update_cache_ttl():
     """Permite ajustar dinámicamente el TTL de la caché desde la UI."""
     global _CACHE_TTL
@@ -440,6 +462,21 @@ def _get_intervalo(default="mes"):
     return intervalo
 
 
+def _dia(columna):
+    """Trunca una fecha al día en SQL; DATE() existe tanto en SQLite como en Postgres.
+
+    Agrupar por día en la BD reduce las filas a una por día con actividad y
+    deja en Python sólo el reparto en semanas/meses/trimestres, que sigue
+    siendo independiente del motor.
+    """
+    return func.date(columna).label("dia")
+
+
+def _como_fecha(valor):
+    # SQLite devuelve DATE() como texto ISO; Postgres, como objeto date.
+    return date.fromisoformat(valor) if isinstance(valor, str) else valor
+
+
 def _dataset_distribucion_productos():
     productos = (
         db.session.query(Producto.tipo_producto, func.count(Producto.id))
@@ -457,9 +494,12 @@ def _dataset_ventas_totales(intervalo: str):
     ventas_totales = defaultdict(float)
     orden = {}
     etiqueta_periodo = None
-    for compra in Compra.query.all():
-        clave, label, etiqueta_periodo = _period_key_and_label(compra.fecha, intervalo)
-        ventas_totales[label] += float(compra.total or 0)
+    # Sólo columnas: las filas no son entidades y no pueden disparar cargas
+    # perezosas de relaciones al construir el dataset.
+    dia = _dia(Compra.fecha)
+    for fecha, total in db.session.query(dia, func.sum(Compra.total)).group_by(dia):
+        clave, label, etiqueta_periodo = _period_key_and_label(_como_fecha(fecha), intervalo)
+        ventas_totales[label] += float(total or 0)
         orden[label] = clave
 
     if etiqueta_periodo is None:
@@ -470,24 +510,38 @@ def _dataset_ventas_totales(intervalo: str):
     return {"periodos": periodos, "totales": totales, "period_label": etiqueta_periodo}
 
 
-def _dataset_productos_mas_vendidos(limit=10):
+def _unidades_por_modelo(limit, descendente=True, usuario_id=None):
+    """Top de unidades vendidas por producto con el modelo resuelto en el JOIN.
+
+    Todas las gráficas de productos comparten esta consulta para que ninguna
+    vuelva a traducir IDs a modelos con un SELECT por fila.
+    """
+    unidades = func.sum(Compra.cantidad)
+    query = db.session.query(Producto.modelo, unidades.label("cantidad")).join(
+        Producto, Producto.id == Compra.producto_id
+    )
+    if usuario_id is not None:
+        query = query.filter(Compra.usuario_id == usuario_id)
     ventas = (
-        db.session.query(Producto.modelo, func.sum(Compra.cantidad).label("cantidad"))
-        .join(Producto, Producto.id == Compra.producto_id)
-        .group_by(Producto.id)
-        .order_by(func.sum(Compra.cantidad).desc())
+        query.group_by(Producto.id)
+        .order_by(unidades.desc() if descendente else unidades.asc())
         .limit(limit)
         .all()
     )
-    return {"productos": [venta[0] for venta in ventas], "cantidades": [venta[1] for venta in ventas]}
+    return {"productos": [modelo for modelo, _ in ventas], "cantidades": [cantidad for _, cantidad in ventas]}
+
+
+def _dataset_productos_mas_vendidos(limit=10):
+    return _unidades_por_modelo(limit)
 
 
 def _dataset_usuarios_registrados(intervalo: str):
     totales = defaultdict(int)
     orden = {}
-    for usuario in Usuario.query.order_by(Usuario.fecha_registro.asc()).all():
-        clave, label, _ = _period_key_and_label(usuario.fecha_registro, intervalo)
-        totales[label] += 1
+    dia = _dia(Usuario.fecha_registro)
+    for fecha_registro, registrados in db.session.query(dia, func.count()).group_by(dia).order_by(dia):
+        clave, label, _ = _period_key_and_label(_como_fecha(fecha_registro), intervalo)
+        totales[label] += registrados
         orden[label] = clave
 
     periodos = [label for label, _ in sorted(orden.items(), key=lambda item: item[1])]
@@ -499,17 +553,19 @@ def _dataset_ingresos_por_usuario(intervalo: str):
     ingresos = defaultdict(float)
     orden = {}
 
+    dia = _dia(Compra.fecha)
     compras = (
-        db.session.query(Compra.usuario_id, Compra.fecha, Compra.total)
+        db.session.query(Compra.usuario_id, dia, func.sum(Compra.total))
         .join(Usuario, Usuario.id == Compra.usuario_id)
-        .order_by(Compra.fecha.asc())
+        .group_by(Compra.usuario_id, dia)
+        .order_by(dia, Compra.usuario_id)
         .all()
     )
 
-    for compra in compras:
-        clave_periodo, etiqueta, _ = _period_key_and_label(compra.fecha, intervalo)
-        clave = (compra.usuario_id, etiqueta)
-        ingresos[clave] += float(compra.total or 0)
+    for usuario_id, fecha, total in compras:
+        clave_periodo, etiqueta, _ = _period_key_and_label(_como_fecha(fecha), intervalo)
+        clave = (usuario_id, etiqueta)
+        ingresos[clave] += float(total or 0)
         orden[clave] = clave_periodo
 
     ordered_keys = [key for key, _ in sorted(orden.items(), key=lambda item: item[1])]
@@ -519,18 +575,7 @@ def _dataset_ingresos_por_usuario(intervalo: str):
 
 
 def _dataset_productos_menos_vendidos(limit=10):
-    ventas = (
-        db.session.query(Compra.producto_id, func.sum(Compra.cantidad).label("cantidad"))
-        .group_by(Compra.producto_id)
-        .order_by(func.sum(Compra.cantidad).asc())
-        .limit(limit)
-        .all()
-    )
-
-    return {
-        "productos": [db.session.get(Producto, venta.producto_id).modelo for venta in ventas],
-        "cantidades": [venta.cantidad for venta in ventas],
-    }
+    return _unidades_por_modelo(limit, descendente=False)
 
 
 def _dataset_compras_por_categoria():
@@ -552,7 +597,7 @@ def _dataset_ingresos_gastos(intervalo: str):
 
     # Consulta de apuntes de cuentas de grupo 6 y 7
     apuntes = (
-        db.session.query(Apunte, Cuenta.codigo, Asiento.fecha)
+        db.session.query(Apunte.debe, Apunte.haber, Cuenta.codigo, Asiento.fecha)
         .join(Cuenta, Apunte.cuenta_id == Cuenta.id)
         .join(Asiento, Apunte.asiento_id == Asiento.id)
         .filter(
@@ -562,11 +607,11 @@ def _dataset_ingresos_gastos(intervalo: str):
         .all()
     )
 
-    for apunte, codigo, fecha in apuntes:
+    for debe, haber, codigo, fecha in apuntes:
         clave, label, etiqueta_periodo = _period_key_and_label(fecha, intervalo)
         orden[label] = clave
         
-        saldo = float(apunte.haber - apunte.debe)
+        saldo = float(haber - debe)
         
         if codigo.startswith('7'): # Ingreso
              # En contabilidad, ingresos (Haber) aumentan. Haber - Debe > 0
@@ -577,7 +622,7 @@ def _dataset_ingresos_gastos(intervalo: str):
              # Queremos mostrar gastos como positivo en la gráfica comparativa, o negativo?
              # Normalmente se comparan barras positivas.
              # Gasto neto = Debe - Haber.
-             gastos[label] += float(apunte.debe - apunte.haber)
+             gastos[label] += float(debe - haber)
 
     if etiqueta_periodo is None:
         _, _, etiqueta_periodo = _period_key_and_label(datetime.now(timezone.utc), intervalo)
@@ -601,15 +646,17 @@ def _dataset_cliente_compras_tiempo_builder(intervalo):
     orden = {}
     etiqueta_periodo = None
 
+    dia = _dia(Compra.fecha)
     compras = (
-        Compra.query.filter_by(usuario_id=current_user.id)
-        .order_by(Compra.fecha.asc())
-        .all()
+        db.session.query(dia, func.sum(Compra.total))
+        .filter(Compra.usuario_id == current_user.id)
+        .group_by(dia)
+        .order_by(dia)
     )
 
-    for compra in compras:
-        clave, label, etiqueta_periodo = _period_key_and_label(compra.fecha, intervalo)
-        totales[label] += float(compra.total or 0)
+    for fecha, total in compras:
+        clave, label, etiqueta_periodo = _period_key_and_label(_como_fecha(fecha), intervalo)
+        totales[label] += float(total or 0)
         orden[label] = clave
 
     if etiqueta_periodo is None:
@@ -620,16 +667,7 @@ def _dataset_cliente_compras_tiempo_builder(intervalo):
     return {"periodos": periodos, "totales": montos, "period_label": etiqueta_periodo}
 
 def _dataset_cliente_productos_favoritos_builder():
-    favoritos = (
-        db.session.query(Producto.modelo, func.sum(Compra.cantidad).label("cantidad"))
-        .join(Producto, Producto.id == Compra.producto_id)
-        .filter(Compra.usuario_id == current_user.id)
-        .group_by(Producto.id)
-        .order_by(func.sum(Compra.cantidad).desc())
-        .limit(5)
-        .all()
-    )
-    return {"productos": [modelo for modelo, _ in favoritos], "cantidades": [cantidad for _, cantidad in favoritos]}
+    return _unidades_por_modelo(5, usuario_id=current_user.id)
 
 def _dataset_cliente_estados_pedido_builder():
     estados = (
@@ -683,21 +721,21 @@ _CHART_EXPORTERS = {
 
 @reportes_bp.route('/graficas', methods=["GET"])
 @login_required
-@role_required("admin")
+@admin_required
 def graficas():
     return render_template("graficas.html")
 
 
 @reportes_bp.route('/data/distribucion_productos')
 @login_required
-@role_required("admin")
+@admin_required
 def data_distribucion_productos():
     return _cached_json("distribucion_productos", _dataset_distribucion_productos)
 
 
 @reportes_bp.route('/data/ventas_totales')
 @login_required
-@role_required("admin")
+@admin_required
 def data_ventas_totales():
     intervalo = _get_intervalo()
     if intervalo is None:
@@ -709,14 +747,14 @@ def data_ventas_totales():
 
 @reportes_bp.route('/data/productos_mas_vendidos')
 @login_required
-@role_required("admin")
+@admin_required
 def data_productos_mas_vendidos():
     return _cached_json("productos_mas_vendidos", _dataset_productos_mas_vendidos)
 
 
 @reportes_bp.route('/data/usuarios_registrados')
 @login_required
-@role_required("admin")
+@admin_required
 def data_usuarios_registrados():
     intervalo = _get_intervalo()
     if intervalo is None:
@@ -728,7 +766,7 @@ def data_usuarios_registrados():
 
 @reportes_bp.route('/data/ingresos_por_usuario')
 @login_required
-@role_required("admin")
+@admin_required
 def data_ingresos_por_usuario():
     intervalo = _get_intervalo()
     if intervalo is None:
@@ -740,21 +778,21 @@ def data_ingresos_por_usuario():
 
 @reportes_bp.route('/data/compras_por_categoria')
 @login_required
-@role_required("admin")
+@admin_required
 def data_compras_por_categoria():
     return _cached_json("compras_por_categoria", _dataset_compras_por_categoria)
 
 
 @reportes_bp.route('/data/productos_menos_vendidos')
 @login_required
-@role_required("admin")
+@admin_required
 def data_productos_menos_vendidos():
     return _cached_json("productos_menos_vendidos", _dataset_productos_menos_vendidos)
 
 
 @reportes_bp.route('/data/ingresos_gastos')
 @login_required
-@role_required("admin")
+@admin_required
 def data_ingresos_gastos():
     intervalo = _get_intervalo()
     if intervalo is None:
@@ -766,14 +804,14 @@ def data_ingresos_gastos():
 
 @reportes_bp.route("/graficas_cliente", methods=["GET"])
 @login_required
-@role_required("cliente")
+@cliente_required
 def graficas_cliente():
     return render_template("graficas-cliente.html")
 
 
 @reportes_bp.route("/data/cliente/compras_tiempo")
 @login_required
-@role_required("cliente")
+@cliente_required
 def data_cliente_compras_tiempo():
     """Agrega los totales gastados por el cliente segn el intervalo solicitado."""
     intervalo = _get_intervalo()
@@ -786,7 +824,7 @@ def data_cliente_compras_tiempo():
 
 @reportes_bp.route("/data/cliente/productos_favoritos")
 @login_required
-@role_required("cliente")
+@cliente_required
 def data_cliente_productos_favoritos():
     """Top de productos comprados por el cliente actual."""
     cache_key = _make_cache_key("cliente_favoritos", usuario=current_user.id)
@@ -795,7 +833,7 @@ def data_cliente_productos_favoritos():
 
 @reportes_bp.route("/data/cliente/estados_pedido")
 @login_required
-@role_required("cliente")
+@cliente_required
 def data_cliente_estados_pedido():
     """Distribucin de pedidos por estado para el cliente actual."""
     cache_key = _make_cache_key("cliente_estados", usuario=current_user.id)
@@ -1,6 +1,33 @@
 """Instancia de base de datos para compartir en toda la app."""
 
+import sqlite3
+
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 
 # Instancia global inicializada en create_app.
 db = SQLAlchemy()
+
+# WAL deja leer mientras otro escribe y, con synchronous=NORMAL, cada COMMIT
+# sólo añade al log en lugar de hacer fsync del fichero de la base; los
+# temporales de ORDER BY/GROUP BY van a memoria y las lecturas por mmap.
+_SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+)
+
+
+@event.listens_for(Engine, "connect")
+def _configurar_sqlite(dbapi_connection, connection_record):
+    """Aplica los PRAGMA de rendimiento a cada conexión SQLite nueva."""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma in _SQLITE_PRAGMAS:
+            cursor.execute(pragma)
+    finally:
+        cursor.close()
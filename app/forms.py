@@ -1,8 +1,10 @@
 import re
+from datetime import date
+from decimal import Decimal, InvalidOperation
 
-from wtforms import PasswordField, DateField, FieldList, FormField
+from wtforms import PasswordField, DateField
 from wtforms.validators import EqualTo, ValidationError
-from wtforms.validators import Email, Regexp
+from wtforms.validators import Email
 from flask_wtf import FlaskForm
 from wtforms import (
     StringField,
@@ -17,16 +19,60 @@ from wtforms.validators import DataRequired, Length, NumberRange, Optional
 from wtforms.widgets import CheckboxInput, ListWidget
 
 
+# Validadores sin estado ni mensaje propio: se comparten entre campos en lugar
+# de instanciar uno nuevo por cada declaración. Los que llevan mensaje
+# personalizado se siguen creando en línea.
+_REQUIRED = DataRequired()
+_OPTIONAL = Optional()
+_LEN_50 = Length(min=3, max=50)
+_LEN_100 = Length(max=100)
+_NR_NO_NEGATIVO = NumberRange(min=0)
+_NR_PRECIO = NumberRange(min=0.01)
+
+# Clases de carácter exigidas en la contraseña, compiladas una vez al importar.
+_PASSWORD_RES = tuple(re.compile(patron) for patron in (r"[A-Z]", r"[a-z]", r"[0-9]", r"[\W_]"))
+
+
 def _strong_password(form, field):
     value = field.data or ""
     if not value:
         return
-    if len(value) < 8 or not re.search(r"[A-Z]", value) or not re.search(r"[a-z]", value) or not re.search(r"[0-9]", value) or not re.search(r"[\W_]", value):
+    if len(value) < 8 or not all(patron.search(value) for patron in _PASSWORD_RES):
         raise ValidationError(
             "La contraseÃƒÆ’Ã‚Â±a debe tener al menos 8 caracteres, con mayÃƒÆ’Ã‚Âºscula, minÃƒÆ’Ã‚Âºscula, nÃƒÆ’Ã‚Âºmero y sÃƒÆ’Ã‚Â­mbolo."
         )
 
 
+def _telefono_valido(form, field):
+    # Comprobaciones con métodos de str en lugar de Regexp: el patrón es
+    # trivial y evita pasar por el motor de expresiones regulares.
+    value = field.data or ""
+    if not (9 <= len(value) <= 15 and value.isascii() and value.isdigit()):
+        raise ValidationError("El telÃƒÆ’Ã‚Â©fono debe contener entre 9 y 15 dÃƒÆ’Ã‚Â­gitos.")
+
+
+def _cif_valido(form, field):
+    value = field.data or ""
+    if len(value) != 9 or not value.isascii() or not value.isalnum():
+        raise ValidationError("El CIF debe contener 9 caracteres alfanumÃƒÆ’Ã‚Â©ricos.")
+
+
+_FECHA_FMT = "%Y-%m-%d"
+
+
+class _IsoDateField(DateField):
+    """DateField que parsea ISO 8601 con date.fromisoformat en vez de strptime."""
+
+    def process_formdata(self, valuelist):
+        if not valuelist:
+            return
+        try:
+            self.data = date.fromisoformat(valuelist[0].strip())
+        except ValueError:
+            self.data = None
+            raise ValueError(self.gettext("Not a valid date value."))
+
+
 class MultiCheckboxField(SelectMultipleField):
     """Render a SelectMultipleField as a list of checkboxes."""
 
@@ -36,43 +82,43 @@ class MultiCheckboxField(SelectMultipleField):
 class Formulario_de_registro(FlaskForm):
     nombre= StringField(
         "Nombre",
-        validators= [DataRequired()]
+        validators= [_REQUIRED]
     )
     usuario = StringField(
         "Usuario",
         # Ajustamos la longitud mÃƒÆ’Ã‚Â¡xima para que coincida con la columna
         # (50 caracteres) y evitar truncados en BD.
-        validators=[DataRequired(), Length(min=3, max=50)]
+        validators=[_REQUIRED, _LEN_50]
     )
     direccion = StringField(
         "Direccion",
         # Se amplÃƒÆ’Ã‚Â­a a 150 para acompaÃƒÆ’Ã‚Â±ar el tamaÃƒÆ’Ã‚Â±o de columna y permitir
         # direcciones mÃƒÆ’Ã‚Â¡s completas.
-        validators=[DataRequired(), Length(min=3, max=150)]
+        validators=[_REQUIRED, Length(min=3, max=150)]
     )
     contrasenya = PasswordField(
         "ContraseÃƒÆ’Ã‚Â±a",
-        validators=[DataRequired(), _strong_password]
+        validators=[_REQUIRED, _strong_password]
     )
     contrasenya2 = PasswordField(
         'Confirmar ContraseÃƒÆ’Ã‚Â±a',
-        validators=[DataRequired(), EqualTo('contrasenya', message='Las contraseÃƒÆ’Ã‚Â±as deben coincidir')]
+        validators=[_REQUIRED, EqualTo('contrasenya', message='Las contraseÃƒÆ’Ã‚Â±as deben coincidir')]
     )
     registrar = SubmitField("Registrar")
 
 class EditarPerfilForm(FlaskForm):
-    nombre_usuario = StringField('Nombre de Usuario', validators=[DataRequired(), Length(min=2, max=50)])
-    direccion = StringField('DirecciÃƒÆ’Ã‚Â³n', validators=[DataRequired(), Length(min=5, max=100)])
-    current_password = PasswordField('ContraseÃƒÆ’Ã‚Â±a actual', validators=[Optional(), Length(min=6, max=128)])
-    new_password = PasswordField('Nueva contraseÃƒÆ’Ã‚Â±a', validators=[Optional(), _strong_password])
+    nombre_usuario = StringField('Nombre de Usuario', validators=[_REQUIRED, Length(min=2, max=50)])
+    direccion = StringField('DirecciÃƒÆ’Ã‚Â³n', validators=[_REQUIRED, Length(min=5, max=100)])
+    current_password = PasswordField('ContraseÃƒÆ’Ã‚Â±a actual', validators=[_OPTIONAL, Length(min=6, max=128)])
+    new_password = PasswordField('Nueva contraseÃƒÆ’Ã‚Â±a', validators=[_OPTIONAL, _strong_password])
     new_password2 = PasswordField(
         'Confirmar nueva contraseÃƒÆ’Ã‚Â±a',
-        validators=[Optional(), EqualTo('new_password', message='Las contraseÃƒÆ’Ã‚Â±as deben coincidir')]
+        validators=[_OPTIONAL, EqualTo('new_password', message='Las contraseÃƒÆ’Ã‚Â±as deben coincidir')]
     )
     currency_locale = SelectField(
         'Idioma/moneda',
         choices=[('es_ES', 'EspaÃƒÆ’Ã‚Â±ol (ES)'), ('en_US', 'InglÃƒÆ’Ã‚Â©s (US)'), ('en_GB', 'InglÃƒÆ’Ã‚Â©s (GB)')],
-        validators=[Optional()]
+        validators=[_OPTIONAL]
     )
     submit = SubmitField('Guardar Cambios')
 
@@ -104,7 +150,7 @@ class Registro_producto(FlaskForm):
     descripcion = TextAreaField(
         "DescripciÃƒÆ’Ã‚Â³n",
         validators=[
-            Optional(),  # No es obligatorio
+            _OPTIONAL,  # No es obligatorio
             Length(max=500, message="La descripciÃƒÆ’Ã‚Â³n no debe exceder los 500 caracteres.")
         ]
     )
@@ -174,7 +220,7 @@ class ProveedorForm(FlaskForm):
         'TelÃƒÆ’Ã‚Â©fono',
         validators=[
             DataRequired(message="El telÃƒÆ’Ã‚Â©fono es obligatorio."),
-            Regexp(r'^\d{9,15}$', message="El telÃƒÆ’Ã‚Â©fono debe contener entre 9 y 15 dÃƒÆ’Ã‚Â­gitos.")
+            _telefono_valido,
         ]
     )
     direccion = StringField(
@@ -196,13 +242,13 @@ class ProveedorForm(FlaskForm):
         'CIF',
         validators=[
             DataRequired(message="El CIF es obligatorio."),
-            Regexp(r'^[A-Za-z0-9]{9}$', message="El CIF debe contener 9 caracteres alfanumÃƒÆ’Ã‚Â©ricos.")
+            _cif_valido,
         ]
     )
     tasa_de_descuento = DecimalField(
         'Tasa de descuento',
         validators=[
-            Optional(),
+            _OPTIONAL,
             NumberRange(min=0, max=100, message="La tasa de descuento debe estar entre 0 y 100.")
         ]
     )
@@ -216,7 +262,7 @@ class ProveedorForm(FlaskForm):
     productos = MultiCheckboxField(
         'Tipos de productos ofrecidos',
         choices=[],
-        validators=[Optional()],
+        validators=[_OPTIONAL],
     )
 
 
@@ -230,51 +276,117 @@ class AgregarProductoForm(FlaskForm):
 
     tipo_producto = StringField(
         'Tipo de producto',
-        validators=[DataRequired(), Length(max=100)],
+        validators=[_REQUIRED, _LEN_100],
     )
     marca = StringField(
         'Marca',
-        validators=[DataRequired(), Length(max=100)],
+        validators=[_REQUIRED, _LEN_100],
     )
     modelo = StringField(
         'Modelo',
-        validators=[DataRequired(), Length(max=120)],
+        validators=[_REQUIRED, Length(max=120)],
     )
     descripcion = TextAreaField(
-        'DescripciÃƒÆ’Ã‚Â³n', validators=[Optional(), Length(max=500)]
+        'DescripciÃƒÆ’Ã‚Â³n', validators=[_OPTIONAL, Length(max=500)]
     )
     cantidad = IntegerField(
-        'Cantidad', validators=[DataRequired(), NumberRange(min=0)]
+        'Cantidad', validators=[_REQUIRED, _NR_NO_NEGATIVO]
     )
     cantidad_minima = IntegerField(
-        'Cantidad mÃƒÆ’Ã‚Â­nima', validators=[Optional(), NumberRange(min=0)]
+        'Cantidad mÃƒÆ’Ã‚Â­nima', validators=[_OPTIONAL, _NR_NO_NEGATIVO]
     )
     precio = DecimalField(
-        'Precio', validators=[DataRequired(), NumberRange(min=0.01)]
+        'Precio', validators=[_REQUIRED, _NR_PRECIO]
     )
     costo = DecimalField(
-        'Costo', validators=[DataRequired(), NumberRange(min=0.00)]
+        'Costo', validators=[_REQUIRED, _NR_NO_NEGATIVO]
     )
     num_referencia = StringField(
-        'NÃƒÆ’Ã‚Âºmero de referencia', validators=[DataRequired(), Length(max=80)]
+        'NÃƒÆ’Ã‚Âºmero de referencia', validators=[_REQUIRED, Length(max=80)]
     )
     proveedor_id = StringField(
-        'Proveedor', validators=[DataRequired(), Length(max=8)]
+        'Proveedor', validators=[_REQUIRED, Length(max=8)]
     )
 
 
 # --- Formularios de Contabilidad ---
 
-class ApunteForm(FlaskForm):
-    cuenta_codigo = StringField('CÃƒÆ’Ã‚Â³digo Cuenta', validators=[DataRequired()])
-    debe = DecimalField('Debe', default=0.00, validators=[NumberRange(min=0)])
-    haber = DecimalField('Haber', default=0.00, validators=[NumberRange(min=0)])
-
 class AsientoManualForm(FlaskForm):
-    descripcion = StringField('DescripciÃƒÆ’Ã‚Â³n', validators=[DataRequired(), Length(max=255)])
-    fecha = DateField('Fecha', format='%Y-%m-%d', validators=[Optional()])
-    # Usamos FieldList para permitir mÃƒÆ’Ã‚Âºltiples apuntes.
-    # En el frontend se puede usar JS para duplicar campos.
-    # Inicializamos con 2 apuntes mÃƒÆ’Ã‚Â­nimos para partida doble.
-    apuntes = FieldList(FormField(ApunteForm), min_entries=2, max_entries=10)
+    """Cabecera del asiento manual con sus líneas validadas en bloque.
+
+    Las líneas (``apuntes-N-cuenta_codigo/debe/haber``) se leen directamente
+    del formdata en lugar de instanciar un sub-formulario por fila; el
+    resultado normalizado queda en ``apuntes_data`` y las filas en crudo en
+    ``apuntes_filas`` para volver a pintar la tabla.
+    """
+
+    MIN_APUNTES = 2
+    MAX_APUNTES = 10
+
+    descripcion = StringField('DescripciÃƒÆ’Ã‚Â³n', validators=[_REQUIRED, Length(max=255)])
+    fecha = _IsoDateField('Fecha', format=_FECHA_FMT, validators=[_OPTIONAL])
     submit = SubmitField('Crear Asiento')
+
+    def process(self, formdata=None, obj=None, data=None, extra_filters=None, **kwargs):
+        formdata = self.meta.wrap_formdata(self, formdata)
+        super().process(formdata, obj, data=data, extra_filters=extra_filters, **kwargs)
+        self.apuntes_filas = self._leer_filas(formdata)
+        self.apuntes_data = []
+        self.apuntes_errors = []
+
+    def _leer_filas(self, formdata):
+        filas = []
+        if formdata:
+            indices = set()
+            for key in formdata.keys():
+                prefijo, _, resto = key.partition("-")
+                indice, _, campo = resto.partition("-")
+                if prefijo == "apuntes" and campo == "cuenta_codigo" and indice.isdigit():
+                    indices.add(int(indice))
+            for indice in sorted(indices):
+                filas.append({
+                    campo: (formdata.get(f"apuntes-{indice}-{campo}") or "").strip()
+                    for campo in ("cuenta_codigo", "debe", "haber")
+                })
+        while len(filas) < self.MIN_APUNTES:
+            filas.append({"cuenta_codigo": "", "debe": "0.00", "haber": "0.00"})
+        return filas
+
+    def validate(self, extra_validators=None):
+        valido = super().validate(extra_validators=extra_validators)
+        return self.validate_apuntes() and valido
+
+    def validate_apuntes(self):
+        """Normaliza las líneas rellenas y acumula los errores.
+
+        Sólo se ignoran las filas totalmente vacías (sin cuenta y sin
+        importes); una fila con importes y sin cuenta es un error, no una
+        línea que se pueda descartar sin avisar.
+        """
+        self.apuntes_data = []
+        self.apuntes_errors = []
+        rellenas = 0
+        for numero, fila in enumerate(self.apuntes_filas, start=1):
+            importes = {}
+            for campo in ("debe", "haber"):
+                try:
+                    importe = Decimal(fila[campo] or "0")
+                except InvalidOperation:
+                    importe = None
+                if importe is None or not importe.is_finite() or importe < 0:
+                    self.apuntes_errors.append(f"Línea {numero}: importe de {campo} no válido.")
+                    importe = None
+                importes[campo] = importe
+            if not fila["cuenta_codigo"] and all(importe == 0 for importe in importes.values()):
+                continue
+            rellenas += 1
+            if rellenas > self.MAX_APUNTES:
+                self.apuntes_errors.append(f"Máximo {self.MAX_APUNTES} apuntes por asiento.")
+                return False
+            if not fila["cuenta_codigo"]:
+                self.apuntes_errors.append(f"Línea {numero}: falta la cuenta.")
+            elif None not in importes.values():
+                self.apuntes_data.append({"cuenta_codigo": fila["cuenta_codigo"], **importes})
+        if not self.apuntes_errors and len(self.apuntes_data) < self.MIN_APUNTES:
+            self.apuntes_errors.append(f"El asiento necesita al menos {self.MIN_APUNTES} apuntes.")
+        return not self.apuntes_errors
@@ -0,0 +1,36 @@
+"""Proveedor JSON de Flask respaldado por orjson.
+
+orjson serializa directamente a bytes en C; se delega en él para todas las
+respuestas de ``jsonify`` manteniendo la semántica del proveedor por defecto
+(claves ordenadas, fechas en formato HTTP, Decimal como texto).
+"""
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - dependencia opcional
+    orjson = None
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Sustituto de DefaultJSONProvider que usa orjson si está instalado."""
+
+    def dumps(self, obj, **kwargs):
+        # Las fechas se ceden a ``default`` para conservar el formato HTTP de
+        # Flask en lugar del ISO 8601 nativo de orjson.
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if kwargs.get("sort_keys", self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get("indent"):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=kwargs.get("default", self.default), option=option).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
+def init_json_provider(app):
+    """Activa orjson en la app cuando la librería está disponible."""
+    if orjson is not None:
+        app.json = OrjsonProvider(app)
@@ -6,9 +6,11 @@ en cuanto a seguridad y consistencia de datos.
 
 import secrets
 from datetime import datetime, timezone
+from decimal import Decimal
 
 from flask_login import UserMixin
-from sqlalchemy import ForeignKey
+from sqlalchemy import DateTime, ForeignKey, Integer, Numeric, String, Text
+from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from .db import db
 from .extensions import bcrypt
@@ -19,36 +21,46 @@ def utcnow():
     return datetime.now(timezone.utc)
 
 
+def _short_id():
+    """IDs cortos de 8 caracteres hex compartidos por todas las tablas."""
+    return secrets.token_hex(4)[:8]
+
+
 class Usuario(UserMixin, db.Model):
     __tablename__ = "usuario"
-    __table_args__ = {"sqlite_autoincrement": True}
 
     # IDs cortos de 8 caracteres para legibilidad, pero no autoincrementales.
-    id = db.Column(db.String(8), primary_key=True, default=lambda: secrets.token_hex(4)[:8])
+    id: Mapped[str] = mapped_column(String(8), primary_key=True, default=_short_id)
     # Se fijan longitudes y unicidad para evitar duplicados y truncados.
-    nombre = db.Column(db.String(80), nullable=False)
-    usuario = db.Column(db.String(50), nullable=False, unique=True)
-    direccion = db.Column(db.String(150), nullable=False)
-    contrasenya_hash = db.Column(db.String(128), nullable=False)
-    rol = db.Column(db.String(20), nullable=False)
-    fecha_registro = db.Column(db.DateTime, nullable=False, default=utcnow)
-
-    def hash_contrasenya(self, contrasenya: str) -> None:
+    nombre: Mapped[str] = mapped_column(String(80), nullable=False)
+    usuario: Mapped[str] = mapped_column(String(50), nullable=False, unique=True)
+    direccion: Mapped[str] = mapped_column(String(150), nullable=False)
+    contrasenya_hash: Mapped[str] = mapped_column(String(128), nullable=False)
+    rol: Mapped[str] = mapped_column(String(20), nullable=False)
+    # Indexada para el gráfico de registros por día.
+    fecha_registro: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=utcnow, index=True)
+
+    # Ambos helpers son estáticos: sólo necesitan el hash, por lo que pueden
+    # usarse sin cargar la instancia completa (p. ej. al consultar solo la
+    # columna contrasenya_hash).
+    @staticmethod
+    def hash_contrasenya(contrasenya: str) -> str:
         """Genera un hash usando flask-bcrypt configurado en la app."""
         # Se usa la extensión configurada en lugar de la librería directa
         # para honrar los parámetros globales (por ejemplo, rounds).
-        self.contrasenya_hash = bcrypt.generate_password_hash(contrasenya).decode("utf-8")
+        return bcrypt.generate_password_hash(contrasenya).decode("utf-8")
 
-    def check_contrasenya(self, contrasenya: str) -> bool:
-        """Valida la contraseña usando el hash almacenado."""
-        return bcrypt.check_password_hash(self.contrasenya_hash, contrasenya)
+    @staticmethod
+    def check_contrasenya(contrasenya_hash: str, contrasenya: str) -> bool:
+        """Valida la contraseña contra el hash almacenado."""
+        return bcrypt.check_password_hash(contrasenya_hash, contrasenya)
 
     def __init__(self, nombre, usuario, direccion, contrasenya, rol, fecha_registro=None):
         self.nombre = nombre
         self.usuario = usuario
         self.direccion = direccion
         # Se delega en el método que aplica bcrypt configurado.
-        self.hash_contrasenya(contrasenya)
+        self.contrasenya_hash = self.hash_contrasenya(contrasenya)
         self.rol = rol
         # Fecha por defecto calculada en Python para mantener trazabilidad.
         self.fecha_registro = fecha_registro or utcnow()
@@ -60,22 +72,25 @@ class Usuario(UserMixin, db.Model):
 class Producto(db.Model):
     __tablename__ = "producto"
 
-    id = db.Column(db.String(8), primary_key=True, default=lambda: secrets.token_hex(4)[:8])
+    id: Mapped[str] = mapped_column(String(8), primary_key=True, default=_short_id)
     # Claves foráneas tipadas como String para alinearse con el ID del proveedor.
-    proveedor_id = db.Column(db.String(8), db.ForeignKey("proveedor.id"), nullable=False)
-    tipo_producto = db.Column(db.String(100), nullable=False)
-    modelo = db.Column(db.String(120), nullable=False)
-    descripcion = db.Column(db.String(500), nullable=True)
-    cantidad = db.Column(db.Integer, nullable=False)
-    cantidad_minima = db.Column(db.Integer, nullable=True)
-    precio = db.Column(db.Numeric(10, 2), nullable=False)
-    costo = db.Column(db.Numeric(10, 2), nullable=False, default=0.00)
-    marca = db.Column(db.String(100), nullable=True)
-    num_referencia = db.Column(db.String(80), nullable=False)
-    fecha = db.Column(db.DateTime, default=utcnow, nullable=False)
-
-    # Enlazamos explícitamente la tabla pivote para evitar warnings de relaciones solapadas.
-    proveedor_links = db.relationship("ProveedorTipoProducto", back_populates="producto", cascade="all, delete-orphan")
+    proveedor_id: Mapped[str] = mapped_column(String(8), ForeignKey("proveedor.id"), nullable=False, index=True)
+    tipo_producto: Mapped[str] = mapped_column(String(100), nullable=False)
+    modelo: Mapped[str] = mapped_column(String(120), nullable=False)
+    descripcion: Mapped[str | None] = mapped_column(String(500), nullable=True)
+    cantidad: Mapped[int] = mapped_column(Integer, nullable=False)
+    cantidad_minima: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    precio: Mapped[Decimal] = mapped_column(Numeric(10, 2), nullable=False)
+    costo: Mapped[Decimal] = mapped_column(Numeric(10, 2), nullable=False, default=0.00)
+    marca: Mapped[str | None] = mapped_column(String(100), nullable=True)
+    num_referencia: Mapped[str] = mapped_column(String(80), nullable=False)
+    fecha: Mapped[datetime] = mapped_column(DateTime, default=utcnow, nullable=False)
+
+    # La tabla pivote se declara como `secondary` para no materializar una
+    # instancia ORM por cada fila de enlace al recorrer la relación.
+    proveedores: Mapped[list["Proveedor"]] = relationship(
+        secondary="proveedor_tipo_producto", back_populates="productos"
+    )
 
     def __init__(self, proveedor_id, tipo_producto, modelo, descripcion, cantidad, cantidad_minima, precio, marca, num_referencia, costo=0.00, fecha=None):
         self.proveedor_id = proveedor_id
@@ -97,22 +112,27 @@ class Producto(db.Model):
 class Proveedor(db.Model):
     __tablename__ = "proveedor"
 
-    id = db.Column(db.String(8), primary_key=True, default=lambda: secrets.token_hex(4)[:8])
-    nombre = db.Column(db.String(100), nullable=False)
-    telefono = db.Column(db.String(15), nullable=False)
-    direccion = db.Column(db.String(255), nullable=False)
-    email = db.Column(db.String(255), nullable=False)
-    cif = db.Column(db.String(15), nullable=False, unique=True)  # único para evitar duplicados.
-    tasa_de_descuento = db.Column(db.Numeric(10, 2), nullable=True)
-    iva = db.Column(db.Numeric(10, 2), nullable=False)
-    tipo_producto = db.Column(db.String(500), nullable=False)
-    fecha = db.Column(db.DateTime, default=utcnow, nullable=False)
+    id: Mapped[str] = mapped_column(String(8), primary_key=True, default=_short_id)
+    # Indexado: el listado paginado ordena por nombre.
+    nombre: Mapped[str] = mapped_column(String(100), nullable=False, index=True)
+    telefono: Mapped[str] = mapped_column(String(15), nullable=False)
+    direccion: Mapped[str] = mapped_column(String(255), nullable=False)
+    email: Mapped[str] = mapped_column(String(255), nullable=False)
+    cif: Mapped[str] = mapped_column(String(15), nullable=False, unique=True)  # único para evitar duplicados.
+    tasa_de_descuento: Mapped[Decimal | None] = mapped_column(Numeric(10, 2), nullable=True)
+    iva: Mapped[Decimal] = mapped_column(Numeric(10, 2), nullable=False)
+    fecha: Mapped[datetime] = mapped_column(DateTime, default=utcnow, nullable=False)
 
     # Se usan back_populates simétricos para eliminar el warning de overlaps.
-    productos = db.relationship(
-        "ProveedorTipoProducto",
-        back_populates="proveedor",
+    productos: Mapped[list["Producto"]] = relationship(
+        secondary="proveedor_tipo_producto",
+        back_populates="proveedores",
+    )
+    # Un registro por tipo ofrecido en lugar de una cadena separada por comas:
+    # los filtros por tipo son comparaciones indexadas y no búsquedas en texto.
+    tipos: Mapped[list["ProveedorTipo"]] = relationship(
         cascade="all, delete-orphan",
+        order_by="ProveedorTipo.tipo",
     )
 
     def __init__(self, nombre, telefono, direccion, email, cif, tasa_de_descuento, iva, tipo_producto, fecha=None):
@@ -129,27 +149,56 @@ class Proveedor(db.Model):
     def __str__(self):
         return f"Proveedor {self.nombre} agregado correctamente."
 
+    @property
+    def tipo_producto(self):
+        """Tipos como texto para plantillas y exportaciones ("A, B")."""
+        return ", ".join(tipo.tipo for tipo in self.tipos) or "No especificado"
+
+    @tipo_producto.setter
+    def tipo_producto(self, valor):
+        if isinstance(valor, str):
+            valor = valor.split(",")
+        nombres = {nombre.strip() for nombre in valor or ()}
+        nombres.discard("")
+        nombres.discard("No especificado")
+        # Se reutilizan las filas existentes: volver a crear una con la misma
+        # clave primaria chocaría con la que delete-orphan aún no ha borrado.
+        actuales = {tipo.tipo: tipo for tipo in self.tipos}
+        self.tipos = [actuales.get(nombre) or ProveedorTipo(tipo=nombre) for nombre in sorted(nombres)]
 
-class ProveedorTipoProducto(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    proveedor_id = db.Column(db.String(8), db.ForeignKey("proveedor.id"), nullable=False)
-    producto_id = db.Column(db.String(8), db.ForeignKey("producto.id"), nullable=False)
-    # Relaciones explícitas para claridad en consultas sin generar overlaps.
-    proveedor = db.relationship("Proveedor", back_populates="productos")
-    producto = db.relationship("Producto", back_populates="proveedor_links")
+
+class ProveedorTipo(db.Model):
+    __tablename__ = "proveedor_tipo"
+
+    proveedor_id: Mapped[str] = mapped_column(String(8), ForeignKey("proveedor.id"), primary_key=True)
+    # La clave compuesta ya sirve las búsquedas por proveedor; el índice propio
+    # de ``tipo`` cubre las de "proveedores que venden X".
+    tipo: Mapped[str] = mapped_column(String(50), primary_key=True, index=True)
+
+
+# Tabla pivote pura: sin clase mapeada ni ID sustituto, la clave compuesta
+# ya garantiza unicidad y evita un índice extra.
+proveedor_tipo_producto = db.Table(
+    "proveedor_tipo_producto",
+    db.Column("proveedor_id", db.String(8), db.ForeignKey("proveedor.id"), primary_key=True),
+    db.Column("producto_id", db.String(8), db.ForeignKey("producto.id"), primary_key=True),
+)
 
 
 class CestaDeCompra(db.Model):
     __tablename__ = "cesta_de_compra"
+    # Una sola línea por producto y usuario: permite el upsert de la cesta y,
+    # al empezar por usuario_id, sirve también de índice para ese filtro.
+    __table_args__ = (db.UniqueConstraint("usuario_id", "producto_id", name="uq_cesta_usuario_producto"),)
 
-    id = db.Column(db.String(8), primary_key=True, default=lambda: secrets.token_hex(4)[:8])
-    usuario_id = db.Column(db.String(8), db.ForeignKey("usuario.id"), nullable=False)
+    id: Mapped[str] = mapped_column(String(8), primary_key=True, default=_short_id)
+    usuario_id: Mapped[str] = mapped_column(String(8), ForeignKey("usuario.id"), nullable=False)
     # Se homologa el tipo con Producto.id para integridad referencial.
-    producto_id = db.Column(db.String(8), db.ForeignKey("producto.id"), nullable=False)
-    cantidad = db.Column(db.Integer, nullable=False)
+    producto_id: Mapped[str] = mapped_column(String(8), ForeignKey("producto.id"), nullable=False, index=True)
+    cantidad: Mapped[int] = mapped_column(Integer, nullable=False)
 
-    usuario = db.relationship("Usuario", backref=db.backref("cesta_de_compra", lazy=True))
-    producto = db.relationship("Producto", backref=db.backref("cesta_de_compra", lazy=True))
+    usuario: Mapped["Usuario"] = relationship(backref=db.backref("cesta_de_compra", lazy=True))
+    producto: Mapped["Producto"] = relationship(backref=db.backref("cesta_de_compra", lazy=True))
 
     def __init__(self, usuario_id, producto_id, cantidad=1):
         self.usuario_id = usuario_id
@@ -159,21 +208,32 @@ class CestaDeCompra(db.Model):
 
 class Compra(db.Model):
     __tablename__ = "compras"
+    # El índice compuesto sirve los listados por usuario ordenados por fecha
+    # (pedidos, dashboards) y, al empezar por usuario_id, también cubre los
+    # filtros simples por usuario sin necesitar un índice adicional. El de
+    # (usuario_id, estado) sirve los filtros de pedidos activos o pendientes.
+    # (fecha, total) cubre la serie de ventas por día de los gráficos: se
+    # agrega recorriendo el índice sin leer las filas de la tabla.
+    __table_args__ = (
+        db.Index("ix_compra_usuario_fecha", "usuario_id", "fecha"),
+        db.Index("ix_compra_usuario_estado", "usuario_id", "estado"),
+        db.Index("ix_compra_fecha_total", "fecha", "total"),
+    )
 
-    id = db.Column(db.String(8), primary_key=True, default=lambda: secrets.token_hex(4)[:8])
+    id: Mapped[str] = mapped_column(String(8), primary_key=True, default=_short_id)
     # Claves foráneas alineadas con los IDs de tipo String definidos en las tablas.
-    producto_id = db.Column(db.String(8), db.ForeignKey("producto.id"), nullable=False)
-    usuario_id = db.Column(db.String(8), db.ForeignKey("usuario.id"), nullable=False)
-    proveedor_id = db.Column(db.String(8), db.ForeignKey("proveedor.id"), nullable=False)
-    cantidad = db.Column(db.Integer, nullable=False)
-    precio_unitario = db.Column(db.Numeric(10, 2), nullable=False)
-    total = db.Column(db.Numeric(10, 2), nullable=False)
-    estado = db.Column(db.String(20), nullable=False, default="Pendiente")
-    fecha = db.Column(db.DateTime, default=utcnow, nullable=False)
-
-    producto = db.relationship("Producto", backref=db.backref("compras", lazy=True))
-    proveedor = db.relationship("Proveedor", backref=db.backref("compras", lazy=True))
-    usuario = db.relationship("Usuario", backref=db.backref("compras", lazy=True))
+    producto_id: Mapped[str] = mapped_column(String(8), ForeignKey("producto.id"), nullable=False, index=True)
+    usuario_id: Mapped[str] = mapped_column(String(8), ForeignKey("usuario.id"), nullable=False)
+    proveedor_id: Mapped[str] = mapped_column(String(8), ForeignKey("proveedor.id"), nullable=False, index=True)
+    cantidad: Mapped[int] = mapped_column(Integer, nullable=False)
+    precio_unitario: Mapped[Decimal] = mapped_column(Numeric(10, 2), nullable=False)
+    total: Mapped[Decimal] = mapped_column(Numeric(10, 2), nullable=False)
+    estado: Mapped[str] = mapped_column(String(20), nullable=False, default="Pendiente")
+    fecha: Mapped[datetime] = mapped_column(DateTime, default=utcnow, nullable=False)
+
+    producto: Mapped["Producto"] = relationship(backref=db.backref("compras", lazy=True))
+    proveedor: Mapped["Proveedor"] = relationship(backref=db.backref("compras", lazy=True))
+    usuario: Mapped["Usuario"] = relationship(backref=db.backref("compras", lazy=True))
 
     def __init__(self, producto_id, usuario_id, cantidad, precio_unitario, proveedor_id, total, estado="Pendiente", fecha=None):
         self.producto_id = producto_id
@@ -188,13 +248,14 @@ class Compra(db.Model):
 
 class ActividadUsuario(db.Model):
     __tablename__ = "actividad_usuario"
-    id = db.Column(db.String(8), primary_key=True, default=lambda: secrets.token_hex(4)[:8])
-    usuario_id = db.Column(db.String(8), db.ForeignKey("usuario.id"), nullable=False)
-    accion = db.Column(db.String(200), nullable=False)
-    modulo = db.Column(db.String(100), nullable=False)
-    fecha = db.Column(db.DateTime, default=utcnow, nullable=False)
+    id: Mapped[str] = mapped_column(String(8), primary_key=True, default=_short_id)
+    usuario_id: Mapped[str] = mapped_column(String(8), ForeignKey("usuario.id"), nullable=False, index=True)
+    accion: Mapped[str] = mapped_column(String(200), nullable=False)
+    modulo: Mapped[str] = mapped_column(String(100), nullable=False)
+    # Indexada: el panel de actividades pagina ordenando por fecha descendente.
+    fecha: Mapped[datetime] = mapped_column(DateTime, default=utcnow, nullable=False, index=True)
 
-    usuario = db.relationship("Usuario", backref="actividades")
+    usuario: Mapped["Usuario"] = relationship(backref="actividades")
 
     def __repr__(self):
         return f"<ActividadUsuario {self.accion} - {self.modulo}>"
@@ -204,11 +265,11 @@ class ActividadUsuario(db.Model):
 
 class Cuenta(db.Model):
     __tablename__ = "cuenta"
-    id = db.Column(db.Integer, primary_key=True)
-    codigo = db.Column(db.String(20), unique=True, nullable=False)
-    nombre = db.Column(db.String(100), nullable=False)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    codigo: Mapped[str] = mapped_column(String(20), unique=True, nullable=False)
+    nombre: Mapped[str] = mapped_column(String(100), nullable=False)
     # Tipos: 'ACTIVO', 'PASIVO', 'PATRIMONIO', 'INGRESO', 'GASTO'
-    tipo = db.Column(db.String(20), nullable=False)
+    tipo: Mapped[str] = mapped_column(String(20), nullable=False)
 
     def __repr__(self):
         return f"<Cuenta {self.codigo} - {self.nombre}>"
@@ -216,14 +277,15 @@ class Cuenta(db.Model):
 
 class Asiento(db.Model):
     __tablename__ = "asiento"
-    id = db.Column(db.Integer, primary_key=True)
-    fecha = db.Column(db.DateTime, default=utcnow, nullable=False)
-    descripcion = db.Column(db.String(255), nullable=False)
-    usuario_id = db.Column(db.String(8), db.ForeignKey("usuario.id"), nullable=False)
-    referencia_id = db.Column(db.String(50), nullable=True)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    # Indexada para los filtros por rango de fechas del diario y los informes.
+    fecha: Mapped[datetime] = mapped_column(DateTime, default=utcnow, nullable=False, index=True)
+    descripcion: Mapped[str] = mapped_column(String(255), nullable=False)
+    usuario_id: Mapped[str] = mapped_column(String(8), ForeignKey("usuario.id"), nullable=False)
+    referencia_id: Mapped[str | None] = mapped_column(String(50), nullable=True)
 
-    usuario = db.relationship("Usuario", backref="asientos")
-    apuntes = db.relationship("Apunte", back_populates="asiento", cascade="all, delete-orphan")
+    usuario: Mapped["Usuario"] = relationship(backref="asientos")
+    apuntes: Mapped[list["Apunte"]] = relationship(back_populates="asiento", cascade="all, delete-orphan")
 
     def __init__(self, descripcion, usuario_id, referencia_id=None, fecha=None):
         self.descripcion = descripcion
@@ -234,14 +296,14 @@ class Asiento(db.Model):
 
 class Apunte(db.Model):
     __tablename__ = "apunte"
-    id = db.Column(db.Integer, primary_key=True)
-    asiento_id = db.Column(db.Integer, db.ForeignKey("asiento.id"), nullable=False)
-    cuenta_id = db.Column(db.Integer, db.ForeignKey("cuenta.id"), nullable=False)
-    debe = db.Column(db.Numeric(10, 2), default=0.00, nullable=False)
-    haber = db.Column(db.Numeric(10, 2), default=0.00, nullable=False)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    asiento_id: Mapped[int] = mapped_column(Integer, ForeignKey("asiento.id"), nullable=False, index=True)
+    cuenta_id: Mapped[int] = mapped_column(Integer, ForeignKey("cuenta.id"), nullable=False, index=True)
+    debe: Mapped[Decimal] = mapped_column(Numeric(10, 2), default=0.00, nullable=False)
+    haber: Mapped[Decimal] = mapped_column(Numeric(10, 2), default=0.00, nullable=False)
 
-    asiento = db.relationship("Asiento", back_populates="apuntes")
-    cuenta = db.relationship("Cuenta", backref="apuntes")
+    asiento: Mapped["Asiento"] = relationship(back_populates="apuntes")
+    cuenta: Mapped["Cuenta"] = relationship(backref="apuntes")
 
     def __init__(self, cuenta_id, debe=0.00, haber=0.00):
         self.cuenta_id = cuenta_id
@@ -250,7 +312,7 @@ class Apunte(db.Model):
 
 
 class CacheEvent(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    timestamp = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
-    event_type = db.Column(db.String(50), nullable=False) # 'hit', 'miss', 'ttl_update'
-    details = db.Column(db.Text, nullable=True) # JSON string or text description
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    timestamp: Mapped[datetime | None] = mapped_column(DateTime, default=lambda: datetime.now(timezone.utc))
+    event_type: Mapped[str] = mapped_column(String(50), nullable=False) # 'hit', 'miss', 'ttl_update'
+    details: Mapped[str | None] = mapped_column(Text, nullable=True) # JSON string or text description
@@ -3,7 +3,7 @@ from datetime import datetime
 from flask import current_app
 from app.db import db
 from app.models import Cuenta, Asiento, Apunte
-from sqlalchemy import func
+from sqlalchemy import func, insert
 
 def inicializar_plan_cuentas():
     """Crea las cuentas contables básicas si no existen."""
@@ -30,13 +30,15 @@ def inicializar_plan_cuentas():
         {"codigo": "693", "nombre": "Pérdidas por Deterioro", "tipo": "GASTO"}, # Costo de ventas
     ]
 
-    for data in cuentas_basicas:
-        cuenta = Cuenta.query.filter_by(codigo=data["codigo"]).first()
-        if not cuenta:
-            nueva_cuenta = Cuenta(codigo=data["codigo"], nombre=data["nombre"], tipo=data["tipo"])
-            db.session.add(nueva_cuenta)
-    
+    # Dos sentencias fijas en lugar de un SELECT (y un INSERT) por cuenta: si el
+    # plan ya está completo no se escribe nada.
+    existentes = set(_ids_cuentas_por_codigo([data["codigo"] for data in cuentas_basicas]))
+    faltantes = [data for data in cuentas_basicas if data["codigo"] not in existentes]
+    if not faltantes:
+        return
+
     try:
+        db.session.execute(insert(Cuenta), faltantes)
         db.session.commit()
         current_app.logger.info("Plan de cuentas inicializado.")
     except Exception as e:
@@ -46,16 +48,26 @@ def inicializar_plan_cuentas():
 def obtener_cuenta_por_codigo(codigo):
     return Cuenta.query.filter_by(codigo=codigo).first()
 
+def _ids_cuentas_por_codigo(codigos):
+    """Resuelve varios códigos de cuenta a su ID con un único SELECT ... IN."""
+    return dict(db.session.query(Cuenta.codigo, Cuenta.id).filter(Cuenta.codigo.in_(codigos)).all())
+
 def crear_asiento(descripcion, usuario_id, fecha=None, referencia_id=None, apuntes_data=None):
     """
     Crea un asiento contable con sus apuntes.
     apuntes_data: lista de dicts {'cuenta_codigo': str, 'debe': Decimal, 'haber': Decimal}
     """
-    apuntes_data = apuntes_data or []
+    # Una sola pasada: cada importe se convierte a Decimal una vez y se reutiliza
+    # tanto para validar el cuadre como para el INSERT de apuntes.
+    lineas = []
+    total_debe = total_haber = Decimal(0)
+    for a in apuntes_data or []:
+        debe, haber = Decimal(a['debe']), Decimal(a['haber'])
+        total_debe += debe
+        total_haber += haber
+        lineas.append((a['cuenta_codigo'], debe, haber))
+
     # Validar que debe == haber
-    total_debe = sum(Decimal(a['debe']) for a in apuntes_data)
-    total_haber = sum(Decimal(a['haber']) for a in apuntes_data)
-    
     if total_debe != total_haber:
         raise ValueError(f"El asiento está descuadrado: Debe={total_debe}, Haber={total_haber}")
 
@@ -63,38 +75,57 @@ def crear_asiento(descripcion, usuario_id, fecha=None, referencia_id=None, apunt
     db.session.add(asiento)
     db.session.flush() # Para obtener el ID del asiento
 
-    for apunte_dict in apuntes_data:
-        cuenta = obtener_cuenta_por_codigo(apunte_dict['cuenta_codigo'])
-        if not cuenta:
-            inicializar_plan_cuentas()
-            cuenta = obtener_cuenta_por_codigo(apunte_dict['cuenta_codigo'])
-        if not cuenta:
-            raise ValueError(f"Cuenta no encontrada: {apunte_dict['cuenta_codigo']}")
-        
-        apunte = Apunte(
-            cuenta_id=cuenta.id,
-            debe=Decimal(apunte_dict['debe']),
-            haber=Decimal(apunte_dict['haber'])
-        )
-        apunte.asiento = asiento
-        db.session.add(apunte)
+    # Todas las cuentas del asiento en una consulta; el plan básico sólo se
+    # inicializa (una vez) si falta alguna. Los IDs se leen siempre de la BD:
+    # un mapa por proceso quedaría obsoleto si el plan se recrea en otro lado.
+    codigos = {codigo for codigo, _, _ in lineas}
+    cuentas = _ids_cuentas_por_codigo(codigos)
+    if codigos - cuentas.keys():
+        inicializar_plan_cuentas()
+        cuentas.update(_ids_cuentas_por_codigo(codigos - cuentas.keys()))
+    for codigo, _, _ in lineas:
+        if codigo not in cuentas:
+            raise ValueError(f"Cuenta no encontrada: {codigo}")
+
+    if lineas:
+        db.session.execute(insert(Apunte), [
+            {'asiento_id': asiento.id, 'cuenta_id': cuentas[codigo], 'debe': debe, 'haber': haber}
+            for codigo, debe, haber in lineas
+        ])
     
     return asiento
 
+def _saldo_segun_tipo(tipo, total_debe, total_haber):
+    if tipo in ['ACTIVO', 'GASTO']:
+        return total_debe - total_haber
+    else:
+        return total_haber - total_debe
+
 def obtener_saldo_cuenta(cuenta_id):
     """Calcula el saldo de una cuenta (Debe - Haber para Activos/Gastos, Haber - Debe para Pasivos/Ingresos)."""
     cuenta = db.session.get(Cuenta, cuenta_id)
     if not cuenta:
         return Decimal(0)
-    
-    apuntes = Apunte.query.filter_by(cuenta_id=cuenta_id).all()
-    total_debe = sum(a.debe for a in apuntes)
-    total_haber = sum(a.haber for a in apuntes)
-    
-    if cuenta.tipo in ['ACTIVO', 'GASTO']:
-        return total_debe - total_haber
-    else:
-        return total_haber - total_debe
+
+    # La suma la hace la BD: llegan dos importes en lugar de todos los apuntes.
+    total_debe, total_haber = db.session.query(
+        func.coalesce(func.sum(Apunte.debe), 0),
+        func.coalesce(func.sum(Apunte.haber), 0),
+    ).filter(Apunte.cuenta_id == cuenta_id).one()
+    return _saldo_segun_tipo(cuenta.tipo, Decimal(total_debe), Decimal(total_haber))
+
+def obtener_saldos_cuentas(cuentas):
+    """Saldos de varias cuentas con un único GROUP BY, indexados por ID de cuenta."""
+    totales = {
+        cuenta_id: (Decimal(total_debe), Decimal(total_haber))
+        for cuenta_id, total_debe, total_haber in db.session.query(
+            Apunte.cuenta_id, func.sum(Apunte.debe), func.sum(Apunte.haber)
+        )
+        .filter(Apunte.cuenta_id.in_([c.id for c in cuentas]))
+        .group_by(Apunte.cuenta_id)
+    }
+    cero = (Decimal(0), Decimal(0))
+    return {c.id: _saldo_segun_tipo(c.tipo, *totales.get(c.id, cero)) for c in cuentas}
 
 def calcular_pmp(producto_id, cantidad_nueva, costo_nuevo):
     """
@@ -1,28 +1,40 @@
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
 from app import create_app, db
 from app.models import Usuario
 
+_UPSERT_INSERTS = {"sqlite": sqlite_insert, "postgresql": postgresql_insert}
+
 app = create_app()
 
 with app.app_context():
-    # Check if admin exists
-    admin = Usuario.query.filter_by(usuario='admin').first()
-    if admin:
-        print("Updating existing admin user...")
-        admin.nombre = 'Administrador Test'
-        admin.direccion = 'Calle Principal 123'
-        admin.rol = 'admin'
-        # Explicitly set password hash if needed, or use method
-        admin.hash_contrasenya('admin123') 
+    # El hash se calcula antes de escribir: la fila sale completa en una sola
+    # sentencia, sin SELECT previo ni UPDATE posterior.
+    datos = {
+        'nombre': 'Administrador Test',
+        'direccion': 'Calle Principal 123',
+        'rol': 'admin',
+        'contrasenya_hash': Usuario.hash_contrasenya('admin123'),
+    }
+    upsert = _UPSERT_INSERTS.get(db.session.get_bind().dialect.name)
+    if upsert is not None:
+        stmt = upsert(Usuario).values(usuario='admin', **datos)
+        db.session.execute(stmt.on_conflict_do_update(index_elements=[Usuario.usuario], set_=datos))
     else:
-        print("Creating new admin user...")
-        admin = Usuario(
-            nombre='Administrador Test',
-            usuario='admin',
-            direccion='Calle Principal 123',
-            contrasenya='admin123',
-            rol='admin'
-        )
-        db.session.add(admin)
-    
+        # Otros motores: consulta y alta/actualización por el ORM.
+        admin = Usuario.query.filter_by(usuario='admin').first()
+        if admin is None:
+            admin = Usuario(
+                nombre=datos['nombre'],
+                usuario='admin',
+                direccion=datos['direccion'],
+                contrasenya='admin123',
+                rol=datos['rol'],
+            )
+            db.session.add(admin)
+        for campo, valor in datos.items():
+            setattr(admin, campo, valor)
+
     db.session.commit()
     print("Admin user 'admin' with password 'admin123' is ready.")
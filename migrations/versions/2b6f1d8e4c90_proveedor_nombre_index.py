@@ -0,0 +1,26 @@
+"""Add proveedor.nombre index
+
+Revision ID: 2b6f1d8e4c90
+Revises: 9e4b7c2d1a58
+Create Date: 2026-10-16 12:05:33.804127
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2b6f1d8e4c90'
+down_revision = '9e4b7c2d1a58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('proveedor', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_proveedor_nombre'), ['nombre'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('proveedor', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_proveedor_nombre'))
@@ -0,0 +1,50 @@
+"""Add indexes on foreign keys and compra(usuario_id, fecha)
+
+Revision ID: 3f1c2a9d7e41
+Revises: b0e10f104c49
+Create Date: 2026-10-16 09:12:04.318220
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a9d7e41'
+down_revision = 'b0e10f104c49'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('producto', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_producto_proveedor_id'), ['proveedor_id'], unique=False)
+
+    with op.batch_alter_table('cesta_de_compra', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_cesta_de_compra_usuario_id'), ['usuario_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_cesta_de_compra_producto_id'), ['producto_id'], unique=False)
+
+    with op.batch_alter_table('compras', schema=None) as batch_op:
+        batch_op.create_index('ix_compra_usuario_fecha', ['usuario_id', 'fecha'], unique=False)
+        batch_op.create_index(batch_op.f('ix_compras_producto_id'), ['producto_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_compras_proveedor_id'), ['proveedor_id'], unique=False)
+
+    with op.batch_alter_table('actividad_usuario', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_actividad_usuario_usuario_id'), ['usuario_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('actividad_usuario', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_actividad_usuario_usuario_id'))
+
+    with op.batch_alter_table('compras', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_compras_proveedor_id'))
+        batch_op.drop_index(batch_op.f('ix_compras_producto_id'))
+        batch_op.drop_index('ix_compra_usuario_fecha')
+
+    with op.batch_alter_table('cesta_de_compra', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_cesta_de_compra_producto_id'))
+        batch_op.drop_index(batch_op.f('ix_cesta_de_compra_usuario_id'))
+
+    with op.batch_alter_table('producto', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_producto_proveedor_id'))
@@ -0,0 +1,26 @@
+"""Add compra(usuario_id, estado) index
+
+Revision ID: 5d2e8a1c9f37
+Revises: c7e2b94f0d18
+Create Date: 2026-10-16 11:02:18.540392
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d2e8a1c9f37'
+down_revision = 'c7e2b94f0d18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('compras', schema=None) as batch_op:
+        batch_op.create_index('ix_compra_usuario_estado', ['usuario_id', 'estado'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('compras', schema=None) as batch_op:
+        batch_op.drop_index('ix_compra_usuario_estado')
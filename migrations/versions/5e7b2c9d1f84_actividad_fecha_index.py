@@ -0,0 +1,26 @@
+"""Index actividad_usuario.fecha for the activity panel
+
+Revision ID: 5e7b2c9d1f84
+Revises: a4d8e2f61b39
+Create Date: 2026-10-16 14:21:05.538912
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e7b2c9d1f84'
+down_revision = 'a4d8e2f61b39'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('actividad_usuario', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_actividad_usuario_fecha'), ['fecha'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('actividad_usuario', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_actividad_usuario_fecha'))
@@ -0,0 +1,67 @@
+"""Move proveedor.tipo_producto into the proveedor_tipo table
+
+Revision ID: 6c3a9f1e2d75
+Revises: 2b6f1d8e4c90
+Create Date: 2026-10-16 12:41:09.517208
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6c3a9f1e2d75'
+down_revision = '2b6f1d8e4c90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('proveedor_tipo',
+    sa.Column('proveedor_id', sa.String(length=8), nullable=False),
+    sa.Column('tipo', sa.String(length=50), nullable=False),
+    sa.ForeignKeyConstraint(['proveedor_id'], ['proveedor.id'], ),
+    sa.PrimaryKeyConstraint('proveedor_id', 'tipo')
+    )
+    with op.batch_alter_table('proveedor_tipo', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_proveedor_tipo_tipo'), ['tipo'], unique=False)
+
+    # La cadena "A, B" se reparte en filas; "No especificado" equivale a
+    # no tener tipos.
+    conn = op.get_bind()
+    filas = []
+    for proveedor_id, tipo_producto in conn.execute(sa.text("SELECT id, tipo_producto FROM proveedor")):
+        tipos = {tipo.strip() for tipo in (tipo_producto or "").split(",")}
+        tipos.discard("")
+        tipos.discard("No especificado")
+        filas.extend({"proveedor_id": proveedor_id, "tipo": tipo} for tipo in sorted(tipos))
+    if filas:
+        conn.execute(
+            sa.text("INSERT INTO proveedor_tipo (proveedor_id, tipo) VALUES (:proveedor_id, :tipo)"),
+            filas,
+        )
+
+    with op.batch_alter_table('proveedor', schema=None) as batch_op:
+        batch_op.drop_column('tipo_producto')
+
+
+def downgrade():
+    with op.batch_alter_table('proveedor', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('tipo_producto', sa.String(length=500), nullable=False, server_default='No especificado'))
+
+    conn = op.get_bind()
+    tipos_por_proveedor = {}
+    for proveedor_id, tipo in conn.execute(
+        sa.text("SELECT proveedor_id, tipo FROM proveedor_tipo ORDER BY proveedor_id, tipo")
+    ):
+        tipos_por_proveedor.setdefault(proveedor_id, []).append(tipo)
+    if tipos_por_proveedor:
+        conn.execute(
+            sa.text("UPDATE proveedor SET tipo_producto = :tipo_producto WHERE id = :id"),
+            [{"id": pid, "tipo_producto": ", ".join(tipos)} for pid, tipos in tipos_por_proveedor.items()],
+        )
+
+    with op.batch_alter_table('proveedor_tipo', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_proveedor_tipo_tipo'))
+
+    op.drop_table('proveedor_tipo')
@@ -0,0 +1,51 @@
+"""Turn proveedor_tipo_producto into a pure association table
+
+Revision ID: 8a5d0c3b61f2
+Revises: 3f1c2a9d7e41
+Create Date: 2026-10-16 09:48:37.902114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8a5d0c3b61f2'
+down_revision = '3f1c2a9d7e41'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Se reconstruye la tabla para sustituir el ID sustituto por la clave
+    # compuesta; DISTINCT descarta enlaces duplicados previos.
+    op.create_table('_proveedor_tipo_producto_new',
+    sa.Column('proveedor_id', sa.String(length=8), nullable=False),
+    sa.Column('producto_id', sa.String(length=8), nullable=False),
+    sa.ForeignKeyConstraint(['producto_id'], ['producto.id'], ),
+    sa.ForeignKeyConstraint(['proveedor_id'], ['proveedor.id'], ),
+    sa.PrimaryKeyConstraint('proveedor_id', 'producto_id')
+    )
+    op.execute(
+        "INSERT INTO _proveedor_tipo_producto_new (proveedor_id, producto_id) "
+        "SELECT DISTINCT proveedor_id, producto_id FROM proveedor_tipo_producto"
+    )
+    op.drop_table('proveedor_tipo_producto')
+    op.rename_table('_proveedor_tipo_producto_new', 'proveedor_tipo_producto')
+
+
+def downgrade():
+    op.create_table('_proveedor_tipo_producto_old',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('proveedor_id', sa.String(length=8), nullable=False),
+    sa.Column('producto_id', sa.String(length=8), nullable=False),
+    sa.ForeignKeyConstraint(['producto_id'], ['producto.id'], ),
+    sa.ForeignKeyConstraint(['proveedor_id'], ['proveedor.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.execute(
+        "INSERT INTO _proveedor_tipo_producto_old (proveedor_id, producto_id) "
+        "SELECT proveedor_id, producto_id FROM proveedor_tipo_producto"
+    )
+    op.drop_table('proveedor_tipo_producto')
+    op.rename_table('_proveedor_tipo_producto_old', 'proveedor_tipo_producto')
@@ -0,0 +1,34 @@
+"""Add indexes on apunte foreign keys and asiento.fecha
+
+Revision ID: 9e4b7c2d1a58
+Revises: 5d2e8a1c9f37
+Create Date: 2026-10-16 11:41:52.117604
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9e4b7c2d1a58'
+down_revision = '5d2e8a1c9f37'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('asiento', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_asiento_fecha'), ['fecha'], unique=False)
+
+    with op.batch_alter_table('apunte', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_apunte_asiento_id'), ['asiento_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_apunte_cuenta_id'), ['cuenta_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('apunte', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_apunte_cuenta_id'))
+        batch_op.drop_index(batch_op.f('ix_apunte_asiento_id'))
+
+    with op.batch_alter_table('asiento', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_asiento_fecha'))
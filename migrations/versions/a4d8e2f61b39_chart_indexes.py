@@ -0,0 +1,32 @@
+"""Add indexes for the chart aggregations
+
+Revision ID: a4d8e2f61b39
+Revises: 6c3a9f1e2d75
+Create Date: 2026-10-16 13:02:47.160385
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4d8e2f61b39'
+down_revision = '6c3a9f1e2d75'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('compras', schema=None) as batch_op:
+        batch_op.create_index('ix_compra_fecha_total', ['fecha', 'total'], unique=False)
+
+    with op.batch_alter_table('usuario', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_usuario_fecha_registro'), ['fecha_registro'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('usuario', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_usuario_fecha_registro'))
+
+    with op.batch_alter_table('compras', schema=None) as batch_op:
+        batch_op.drop_index('ix_compra_fecha_total')
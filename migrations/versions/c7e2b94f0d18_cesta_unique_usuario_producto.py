@@ -0,0 +1,44 @@
+"""Unique (usuario_id, producto_id) on cesta_de_compra
+
+Revision ID: c7e2b94f0d18
+Revises: 8a5d0c3b61f2
+Create Date: 2026-10-16 11:52:10.448391
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7e2b94f0d18'
+down_revision = '8a5d0c3b61f2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Antes de imponer la unicidad se fusionan las líneas duplicadas en la
+    # de menor id, sumando sus cantidades.
+    op.execute(
+        "UPDATE cesta_de_compra SET cantidad = ("
+        " SELECT SUM(c2.cantidad) FROM cesta_de_compra c2"
+        " WHERE c2.usuario_id = cesta_de_compra.usuario_id"
+        " AND c2.producto_id = cesta_de_compra.producto_id)"
+        " WHERE id IN (SELECT MIN(id) FROM cesta_de_compra"
+        " GROUP BY usuario_id, producto_id HAVING COUNT(*) > 1)"
+    )
+    op.execute(
+        "DELETE FROM cesta_de_compra WHERE id NOT IN ("
+        " SELECT MIN(id) FROM cesta_de_compra GROUP BY usuario_id, producto_id)"
+    )
+
+    with op.batch_alter_table('cesta_de_compra', schema=None) as batch_op:
+        # La restricción única empieza por usuario_id y ya cubre ese filtro.
+        batch_op.drop_index(batch_op.f('ix_cesta_de_compra_usuario_id'))
+        batch_op.create_unique_constraint('uq_cesta_usuario_producto', ['usuario_id', 'producto_id'])
+
+
+def downgrade():
+    with op.batch_alter_table('cesta_de_compra', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_cesta_usuario_producto', type_='unique')
+        batch_op.create_index(batch_op.f('ix_cesta_de_compra_usuario_id'), ['usuario_id'], unique=False)
@@ -1,24 +1,39 @@
 import os
+import tempfile
 import unittest
+from unittest import mock
+from datetime import datetime
+from decimal import Decimal
 
 from flask import render_template_string
+from flask.json.provider import DefaultJSONProvider
 
 from app import create_app, format_currency
 
 
 class CurrencyFilterTest(unittest.TestCase):
-    def setUp(self):
+    # Una sola app para toda la clase: los tests sólo tocan la config de moneda,
+    # que se restaura tras cada uno.
+    @classmethod
+    def setUpClass(cls):
         os.environ["DATABASE_URI"] = "sqlite:///:memory:"
         os.environ["WTF_CSRF_ENABLED"] = "false"
         os.environ["FLASK_ENV"] = "testing"
         os.environ["SECRET_KEY"] = "testing-secret"
-        self.app = create_app()
-        self.app.config.update(TESTING=True)
-        self.ctx = self.app.app_context()
-        self.ctx.push()
+        cls.app = create_app()
+        cls.app.config.update(TESTING=True)
+        cls.ctx = cls.app.app_context()
+        cls.ctx.push()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.ctx.pop()
+
+    def setUp(self):
+        self._moneda = {clave: self.app.config[clave] for clave in ("CURRENCY_CODE", "CURRENCY_LOCALE", "CURRENCY_SYMBOL")}
 
     def tearDown(self):
-        self.ctx.pop()
+        self.app.config.update(self._moneda)
 
     def test_default_locale_formatting(self):
         self.app.config.update(CURRENCY_CODE="EUR", CURRENCY_LOCALE="es_ES", CURRENCY_SYMBOL=None)
@@ -31,11 +46,60 @@ class CurrencyFilterTest(unittest.TestCase):
     def test_invalid_input_returns_original_value(self):
         self.assertEqual(format_currency("n/a"), "n/a")
 
+    def test_unknown_locale_falls_back_to_code(self):
+        self.assertEqual(format_currency(1234.5, currency_code="EUR", locale="zz_QQ"), "EUR1.234,50")
+
     def test_context_processor_exposes_symbol(self):
         self.app.config.update(CURRENCY_CODE="USD", CURRENCY_LOCALE="en_US", CURRENCY_SYMBOL="$")
         rendered = render_template_string("{{ currency_symbol }}")
         self.assertEqual(rendered, "$")
 
 
+# Entorno mínimo para las factories de estas pruebas; patch.dict lo retira al
+# salir para no contaminar los tests que se ejecuten después.
+_ENTORNO_APP = {"DATABASE_URI": "sqlite:///:memory:", "SECRET_KEY": "testing-secret"}
+
+
+class JsonProviderTest(unittest.TestCase):
+    def test_matches_default_provider(self):
+        with mock.patch.dict(os.environ, _ENTORNO_APP):
+            app = create_app()
+        datos = {"b": Decimal("1.50"), "a": datetime(2024, 1, 2, 3, 4, 5), "c": [1, None]}
+        esperado = DefaultJSONProvider(app).dumps(datos)
+        obtenido = app.json.dumps(datos)
+        self.assertEqual(app.json.loads(obtenido), app.json.loads(esperado))
+        self.assertLess(obtenido.index('"a"'), obtenido.index('"b"'))
+
+
+class PrecompilarPlantillasTest(unittest.TestCase):
+    def test_compila_todas_las_plantillas_al_arrancar(self):
+        with mock.patch.dict(os.environ, {**_ENTORNO_APP, "PRECOMPILE_TEMPLATES": "true"}):
+            app = create_app()
+        compiladas = {nombre for _, nombre in app.jinja_env.cache.keys()}
+        self.assertIn("base.html", compiladas)
+        self.assertIn("cesta.html", compiladas)
+
+    def test_bytecode_de_plantillas_se_guarda_en_disco(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with mock.patch.dict(os.environ, {**_ENTORNO_APP, "JINJA_CACHE_DIR": tmp}):
+                app = create_app()
+            app.jinja_env.get_template("base.html")
+            self.assertTrue(os.listdir(tmp))
+
+
+class SqlitePragmasTest(unittest.TestCase):
+    def test_conexiones_sqlite_usan_wal(self):
+        from sqlalchemy import create_engine, text
+
+        with tempfile.TemporaryDirectory() as tmp:
+            engine = create_engine(f"sqlite:///{tmp}/pragmas.db")
+            try:
+                with engine.connect() as conn:
+                    self.assertEqual(conn.execute(text("PRAGMA journal_mode")).scalar(), "wal")
+                    self.assertEqual(conn.execute(text("PRAGMA synchronous")).scalar(), 1)
+            finally:
+                engine.dispose()
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -10,10 +10,12 @@ import secrets
 import sys
 import types
 import unittest
+from contextlib import contextmanager
 from pathlib import Path
 
 from flask import url_for
-from datetime import datetime, timezone
+from datetime import date, datetime, timezone
+from sqlalchemy import event, func, select
 from werkzeug.datastructures import MultiDict
 
 # Entorno de pruebas sin acceso a dependencias externas: inyectamos un stub
@@ -34,13 +36,33 @@ if "flask_migrate" not in sys.modules:
 
 from app import create_app
 from app.db import db
-from app.models import Usuario, Producto, Proveedor, CestaDeCompra, Compra, Asiento
-from app.services.accounting_services import inicializar_plan_cuentas, crear_asiento
+from app.models import ActividadUsuario, Usuario, Producto, Proveedor, ProveedorTipo, CestaDeCompra, Compra, Asiento, Apunte, Cuenta
+from app.services.accounting_services import (
+    crear_asiento,
+    inicializar_plan_cuentas,
+    obtener_saldo_cuenta,
+    obtener_saldos_cuentas,
+)
 
 
 _TEST_APP = None
 
 
+@contextmanager
+def contar_consultas(engine):
+    """Acumula las sentencias SQL emitidas dentro del bloque."""
+    sentencias = []
+
+    def _registrar(conn, cursor, statement, parameters, context, executemany):
+        sentencias.append(statement)
+
+    event.listen(engine, "before_cursor_execute", _registrar)
+    try:
+        yield sentencias
+    finally:
+        event.remove(engine, "before_cursor_execute", _registrar)
+
+
 class BaseTestCase(unittest.TestCase):
     def setUp(self):
         # Configuración aislada: BD en memoria y CSRF deshabilitado sólo para pruebas.
@@ -48,21 +70,29 @@ class BaseTestCase(unittest.TestCase):
         os.environ["WTF_CSRF_ENABLED"] = "false"
         os.environ["FLASK_ENV"] = "testing"
         os.environ["SECRET_KEY"] = "testing-secret"
+        # Coste mínimo de bcrypt: las pruebas no miden la robustez del hash.
+        os.environ["BCRYPT_LOG_ROUNDS"] = "4"
         global _TEST_APP
         if _TEST_APP is None:
             _TEST_APP = create_app()
             _TEST_APP.config.update(TESTING=True)
+            # El esquema se crea una sola vez: la BD en memoria vive lo que el
+            # engine de la app y cada test la deja vacía al terminar.
+            with _TEST_APP.app_context():
+                db.create_all()
         self.app = _TEST_APP
         self.client = self.app.test_client()
         rutas = {rule.rule for rule in self.app.url_map.iter_rules()}
         assert "/confirmar-compra" in rutas, rutas
-        with self.app.app_context():
-            db.create_all()
 
     def tearDown(self):
         with self.app.app_context():
             db.session.remove()
-            db.drop_all()
+            # Vaciar las tablas (hijas primero) cuesta mucho menos que el
+            # DROP/CREATE de todo el esquema en cada test.
+            with db.engine.begin() as conn:
+                for tabla in reversed(db.metadata.sorted_tables):
+                    conn.execute(tabla.delete())
 
 
 class AuthFlowTest(BaseTestCase):
@@ -91,6 +121,78 @@ class AuthFlowTest(BaseTestCase):
             self.assertEqual(login_resp.status_code, 302)
             self.assertIn("/menu-cliente", login_resp.headers["Location"])
 
+    def test_user_loader_difiere_columnas_pesadas(self):
+        """El loader de sesión sólo hidrata identidad y rol."""
+        from app.blueprints.auth import cargar_usuario
+
+        with self.app.app_context():
+            usuario = Usuario(
+                nombre="Loader", usuario="loader", direccion="Calle 1", contrasenya="Segura123!", rol="cliente"
+            )
+            db.session.add(usuario)
+            db.session.commit()
+            usuario_id = usuario.id
+            db.session.expunge_all()
+
+            cargado = cargar_usuario(usuario_id)
+            self.assertEqual(cargado.rol, "cliente")
+            self.assertNotIn("contrasenya_hash", cargado.__dict__)
+            self.assertNotIn("direccion", cargado.__dict__)
+            self.assertIsNone(cargar_usuario("noexiste"))
+
+    def test_actividades_no_consulta_usuario_por_fila(self):
+        with self.app.app_context():
+            usuarios = [
+                Usuario(nombre=f"U{i}", usuario=f"autor{i}", direccion="Calle", contrasenya="Segura123!", rol="admin" if i == 0 else "cliente")
+                for i in range(4)
+            ]
+            db.session.add_all(usuarios)
+            db.session.flush()
+            db.session.add(ActividadUsuario(usuario_id=usuarios[0].id, accion="Alta", modulo="Test"))
+            db.session.commit()
+            ids = [usuario.id for usuario in usuarios]
+        with self.client.session_transaction() as sess:
+            sess["_user_id"] = ids[0]
+            sess["_fresh"] = True
+
+        def _consultas():
+            with self.app.app_context(), contar_consultas(db.engine) as sentencias:
+                # El filtro deja a los autores fuera de la tabla de usuarios.
+                self.assertEqual(self.client.get("/actividades?f_rol=admin").status_code, 200)
+            return len(sentencias)
+
+        _consultas()  # la primera petición inicializa el plan de cuentas
+        con_una = _consultas()
+        with self.app.app_context():
+            db.session.add_all(ActividadUsuario(usuario_id=i, accion="Alta", modulo="Test") for i in ids[1:])
+            db.session.commit()
+        self.assertEqual(_consultas(), con_una)
+
+    def test_login_y_registro_no_cargan_filas_completas(self):
+        with self.app.app_context():
+            db.session.add(
+                Usuario(nombre="Login", usuario="login", direccion="Calle 1", contrasenya="Segura123!", rol="cliente")
+            )
+            db.session.commit()
+
+            with contar_consultas(db.engine) as sentencias:
+                resp = self.client.post("/login", data={"usuario": "login", "contrasenya": "Segura123!"})
+            self.assertIn("/menu-cliente", resp.headers["Location"])
+            consulta = next(s for s in sentencias if "WHERE usuario.usuario" in s)
+            self.assertIn("contrasenya_hash", consulta)
+            self.assertNotIn("direccion", consulta)
+
+            duplicado = {
+                "nombre": "Otro",
+                "usuario": "login",
+                "direccion": "Calle 2",
+                "contrasenya": "Segura123!",
+                "contrasenya2": "Segura123!",
+            }
+            resp = self.client.post("/registro", data=duplicado, follow_redirects=True)
+            self.assertIn("ya está registrado", resp.data.decode("utf-8"))
+            self.assertEqual(Usuario.query.count(), 1)
+
     def test_registration_validation_fails(self):
         """Un registro con contraseñas distintas no debería persistir usuario."""
         bad_payload = {
@@ -182,6 +284,219 @@ class CompraFlowTest(BaseTestCase):
             self.assertEqual(producto.cantidad, 0)
             self.assertEqual(CestaDeCompra.query.count(), 0)
 
+    def test_confirmar_compra_acumula_en_pedido_pendiente(self):
+        """Una compra de un producto con pedido pendiente lo amplía en vez de duplicarlo."""
+        with self.app.app_context():
+            cliente, producto = self._create_cliente_y_producto()
+            cliente_id, producto_id = cliente.id, producto.id
+            db.session.add(
+                Compra(
+                    producto_id=producto_id,
+                    usuario_id=cliente_id,
+                    cantidad=1,
+                    precio_unitario=10,
+                    proveedor_id=producto.proveedor_id,
+                    total=10,
+                )
+            )
+            db.session.add(CestaDeCompra(usuario_id=cliente_id, producto_id=producto_id, cantidad=1))
+            db.session.commit()
+
+        with self.client.session_transaction() as session:
+            session["_user_id"] = cliente_id
+            session["_fresh"] = True
+
+        resp = self.client.post(
+            "/confirmar-compra",
+            data={"direccion": "Calle 1", "metodo_pago": "tarjeta"},
+            follow_redirects=False,
+        )
+        self.assertEqual(resp.status_code, 302)
+
+        with self.app.app_context():
+            compras = Compra.query.all()
+            self.assertEqual(len(compras), 1)
+            self.assertEqual(compras[0].cantidad, 2)
+            self.assertEqual(float(compras[0].total), 20.0)
+            self.assertEqual(db.session.get(Producto, producto_id).cantidad, 1)
+
+    def test_cesta_ajena_no_se_puede_modificar(self):
+        with self.app.app_context():
+            cliente, producto = self._create_cliente_y_producto()
+            otro = Usuario(
+                nombre="Otro",
+                usuario="cliente_ajeno",
+                direccion="Calle 2",
+                contrasenya="Segura123!",
+                rol="cliente",
+            )
+            db.session.add(otro)
+            item = CestaDeCompra(usuario_id=cliente.id, producto_id=producto.id, cantidad=1)
+            db.session.add(item)
+            db.session.commit()
+            otro_id, item_id = otro.id, item.id
+
+        with self.client.session_transaction() as session:
+            session["_user_id"] = otro_id
+            session["_fresh"] = True
+
+        resp = self.client.post(f"/actualizar_cesta/{item_id}", data={"cantidad": "5"})
+        self.assertEqual(resp.status_code, 404)
+        self.client.post(f"/eliminar_de_la_cesta/{item_id}")
+
+        with self.app.app_context():
+            self.assertEqual(db.session.get(CestaDeCompra, item_id).cantidad, 1)
+
+    def test_cancelar_pedido_dos_veces_devuelve_stock_una_vez(self):
+        with self.app.app_context():
+            cliente, producto = self._create_cliente_y_producto()
+            cliente_id, producto_id = cliente.id, producto.id
+            compra = Compra(
+                producto_id=producto_id,
+                usuario_id=cliente_id,
+                cantidad=1,
+                precio_unitario=10,
+                proveedor_id=producto.proveedor_id,
+                total=10,
+            )
+            db.session.add(compra)
+            db.session.commit()
+            compra_id = compra.id
+
+        with self.client.session_transaction() as session:
+            session["_user_id"] = cliente_id
+            session["_fresh"] = True
+
+        for _ in range(2):
+            self.assertEqual(self.client.post(f"/cancelar_pedido/{compra_id}").status_code, 302)
+
+        with self.app.app_context():
+            self.assertEqual(db.session.get(Compra, compra_id).estado, "Cancelado")
+            self.assertEqual(db.session.get(Producto, producto_id).cantidad, 3)
+
+    def test_agregar_a_la_cesta_acumula_en_una_linea(self):
+        with self.app.app_context():
+            cliente, producto = self._create_cliente_y_producto()
+            cliente_id, producto_id = cliente.id, producto.id
+
+        with self.client.session_transaction() as session:
+            session["_user_id"] = cliente_id
+            session["_fresh"] = True
+
+        for _ in range(2):
+            resp = self.client.post(f"/agregar_a_la_cesta/{producto_id}", data={"cantidad": 2})
+            self.assertEqual(resp.status_code, 302)
+
+        with self.app.app_context():
+            items = CestaDeCompra.query.filter_by(usuario_id=cliente_id).all()
+            self.assertEqual(len(items), 1)
+            self.assertEqual(items[0].cantidad, 4)
+            self.assertEqual(len(items[0].id), 8)
+
+    def test_alertas_de_stock_cubren_todo_el_catalogo(self):
+        """El aviso de stock bajo no depende de la página que se esté viendo."""
+        with self.app.app_context():
+            cliente, producto = self._create_cliente_y_producto()
+            cliente_id = cliente.id
+            db.session.add(
+                Producto(
+                    proveedor_id=producto.proveedor_id,
+                    tipo_producto="RAM",
+                    modelo="Zeta Escasa",
+                    descripcion="",
+                    cantidad=1,
+                    cantidad_minima=5,
+                    precio=5.0,
+                    marca="Marca",
+                    num_referencia="REF-Z",
+                )
+            )
+            db.session.commit()
+
+        with self.client.session_transaction() as session:
+            session["_user_id"] = cliente_id
+            session["_fresh"] = True
+
+        resp = self.client.get("/productos_cliente?page_size=1&page=1&orden=asc")
+        self.assertEqual(resp.status_code, 200)
+        html = resp.data.decode("utf-8")
+        self.assertIn("Modelo X", html)
+        self.assertIn("Zeta Escasa", html)
+
+    def test_cesta_no_consulta_producto_por_linea(self):
+        """El número de consultas de /cesta no crece con las líneas de la cesta."""
+        with self.app.app_context():
+            cliente, producto = self._create_cliente_y_producto()
+            cliente_id = cliente.id
+            db.session.add(CestaDeCompra(usuario_id=cliente_id, producto_id=producto.id, cantidad=1))
+            db.session.commit()
+            extras = []
+            for idx in range(3):
+                extra = Producto(
+                    proveedor_id=producto.proveedor_id,
+                    tipo_producto="RAM",
+                    modelo=f"Extra {idx}",
+                    descripcion="",
+                    cantidad=5,
+                    cantidad_minima=0,
+                    precio=5.0,
+                    marca="Marca",
+                    num_referencia=f"REF-X{idx}",
+                )
+                db.session.add(extra)
+                extras.append(extra)
+            db.session.commit()
+            extra_ids = [extra.id for extra in extras]
+            engine = db.engine
+
+        with self.client.session_transaction() as session:
+            session["_user_id"] = cliente_id
+            session["_fresh"] = True
+
+        with contar_consultas(engine) as una_linea:
+            self.assertEqual(self.client.get("/cesta").status_code, 200)
+
+        with self.app.app_context():
+            for extra_id in extra_ids:
+                db.session.add(CestaDeCompra(usuario_id=cliente_id, producto_id=extra_id, cantidad=1))
+            db.session.commit()
+
+        with contar_consultas(engine) as cuatro_lineas:
+            resp = self.client.get("/cesta")
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn(b"Extra 2", resp.data)
+        self.assertEqual(len(una_linea), len(cuatro_lineas))
+
+    def test_pedidos_no_consulta_producto_por_fila(self):
+        """El listado de pedidos resuelve el producto en la misma consulta."""
+        with self.app.app_context():
+            cliente, producto = self._create_cliente_y_producto()
+            cliente_id = cliente.id
+            for _ in range(3):
+                db.session.add(
+                    Compra(
+                        producto_id=producto.id,
+                        usuario_id=cliente_id,
+                        cantidad=1,
+                        precio_unitario=producto.precio,
+                        proveedor_id=producto.proveedor_id,
+                        total=producto.precio,
+                    )
+                )
+            db.session.commit()
+            modelo = producto.modelo
+            engine = db.engine
+
+        with self.client.session_transaction() as session:
+            session["_user_id"] = cliente_id
+            session["_fresh"] = True
+
+        with contar_consultas(engine) as sentencias:
+            resp = self.client.get("/pedidos")
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn(modelo.encode(), resp.data)
+        self.assertFalse([s for s in sentencias if s.lstrip().startswith("SELECT producto.")])
+
 
 
     def test_confirma_compra_rechaza_stock_insuficiente(self):
@@ -476,6 +791,155 @@ class DataEndpointsTest(BaseTestCase):
         self.assertEqual(data["periodos"], ["2024-01", "2024-02"])
         self.assertEqual(data["totales"], [2, 1])
 
+    def _crear_ventas(self, usuario_id, vendidas, prefijo):
+        """Crea un producto por elemento de ``vendidas`` con una compra de esas unidades."""
+        proveedor = Proveedor(
+            nombre=f"Proveedor {prefijo}",
+            telefono="123456789",
+            direccion="Ruta 1",
+            email=f"ventas{prefijo}@example.com",
+            cif=f"V{prefijo}1234567",
+            tasa_de_descuento=0,
+            iva=21.0,
+            tipo_producto="RAM",
+        )
+        db.session.add(proveedor)
+        db.session.flush()
+        for idx, unidades in enumerate(vendidas):
+            producto = Producto(
+                proveedor_id=proveedor.id,
+                tipo_producto="RAM",
+                modelo=f"RAM {prefijo}{idx}",
+                descripcion="",
+                cantidad=10,
+                cantidad_minima=0,
+                precio=5.0,
+                marca="Marca",
+                num_referencia=f"REF-{prefijo}{idx}",
+            )
+            db.session.add(producto)
+            db.session.flush()
+            db.session.add(
+                Compra(
+                    producto_id=producto.id,
+                    usuario_id=usuario_id,
+                    cantidad=unidades,
+                    precio_unitario=5,
+                    proveedor_id=proveedor.id,
+                    total=5 * unidades,
+                )
+            )
+        db.session.commit()
+
+    def test_menos_vendidos_resuelve_modelos_en_una_consulta(self):
+        from app.blueprints.reportes import _dataset_productos_menos_vendidos
+
+        with self.app.app_context():
+            admin = self._crear_admin()
+            self._crear_ventas(admin.id, (3, 1, 2), "V")
+
+            with contar_consultas(db.engine) as sentencias:
+                data = _dataset_productos_menos_vendidos()
+
+        self.assertEqual(len(sentencias), 1)
+        self.assertEqual(data, {"productos": ["RAM V1", "RAM V2", "RAM V0"], "cantidades": [1, 2, 3]})
+
+    def test_graficas_no_escalan_consultas_con_los_datos(self):
+        """Cada dataset de gráficas emite las mismas consultas con 1 o 4 productos."""
+        from app.blueprints import reportes
+
+        datasets = {
+            nombre: (lambda grafica=grafica: grafica["builder"]({"interval": "mes"}))
+            for nombre, grafica in reportes._CHART_EXPORTERS.items()
+        }
+        datasets["compras_por_categoria"] = reportes._dataset_compras_por_categoria
+        datasets["productos_menos_vendidos"] = reportes._dataset_productos_menos_vendidos
+
+        def contar():
+            conteos = {}
+            for nombre, dataset in datasets.items():
+                with contar_consultas(db.engine) as sentencias:
+                    dataset()
+                conteos[nombre] = len(sentencias)
+            return conteos
+
+        with self.app.app_context():
+            admin = self._crear_admin()
+            self._crear_ventas(admin.id, (1,), "A")
+            con_un_producto = contar()
+            self._crear_ventas(admin.id, (2, 3, 4), "B")
+            con_cuatro_productos = contar()
+
+        self.assertEqual(con_un_producto, con_cuatro_productos)
+        self.assertTrue(all(total <= 2 for total in con_cuatro_productos.values()), con_cuatro_productos)
+
+    def test_exportar_productos_respeta_filtros_y_orden(self):
+        with self.app.app_context():
+            admin = self._crear_admin()
+            self._crear_ventas(admin.id, (1, 2, 3), "E")
+            admin_id = admin.id
+        self._login(admin_id)
+
+        resp = self.client.get("/productos/export?orden=desc")
+        self.assertTrue(resp.is_streamed)
+        filas = resp.data.decode("utf-8").splitlines()
+        self.assertEqual(filas[0], "Tipo,Marca,Modelo,Descripcion,Precio,Cantidad,Proveedor")
+        self.assertEqual([fila.split(",")[2] for fila in filas[1:]], ["RAM E2", "RAM E1", "RAM E0"])
+
+        filtradas = self.client.get("/productos/export?q=E1").data.decode("utf-8").splitlines()
+        self.assertEqual(len(filtradas), 2)
+        self.assertIn("Proveedor E", self.client.get("/productos").data.decode("utf-8"))
+
+    def test_exportar_compras_admin_no_consulta_por_fila(self):
+        with self.app.app_context():
+            admin = self._crear_admin()
+            self._crear_ventas(admin.id, (1,), "A")
+            admin_id = admin.id
+        self._login(admin_id)
+
+        # La respuesta se genera al consumirla: el cuerpo se lee dentro del bloque.
+        with self.app.app_context(), contar_consultas(db.engine) as con_una:
+            self.client.get("/compras/export").data
+        with self.app.app_context():
+            self._crear_ventas(admin_id, (2, 3, 4), "B")
+        with self.app.app_context(), contar_consultas(db.engine) as con_cuatro:
+            resp = self.client.get("/compras/export")
+            self.assertTrue(resp.is_streamed)
+            cuerpo = resp.data
+
+        self.assertTrue(any("FROM compras" in sentencia for sentencia in con_una))
+        self.assertEqual(len(con_una), len(con_cuatro))
+        filas = cuerpo.decode("utf-8").splitlines()
+        self.assertEqual(len(filas), 5)
+        self.assertTrue(any(",admin1,RAM B2,Proveedor B,4,5.00,20.00,Pendiente," in fila for fila in filas[1:]))
+
+    def test_csv_de_exportacion_se_genera_por_lotes(self):
+        from app.blueprints.helpers import iter_safe_csv
+
+        trozos = list(iter_safe_csv(["a", "b"], ([i, f"={i}"] for i in range(5)), 2))
+        self.assertEqual(len(trozos), 3)
+        self.assertEqual(trozos[0].splitlines(), ["a,b", "0,'=0", "1,'=1"])
+        self.assertEqual("".join(trozos).count("\n"), 6)
+
+    def test_ventas_totales_agrupa_por_dia_en_sql(self):
+        from app.blueprints.reportes import _dataset_ventas_totales
+
+        with self.app.app_context():
+            admin = self._crear_admin()
+            self._crear_ventas(admin.id, (1, 2, 4), "D")
+            fechas = (datetime(2024, 3, 5, 9), datetime(2024, 3, 5, 18), datetime(2024, 4, 1, 12))
+            for compra, fecha in zip(Compra.query.order_by(Compra.cantidad), fechas):
+                compra.fecha = fecha
+            db.session.commit()
+
+            with contar_consultas(db.engine) as sentencias:
+                data = _dataset_ventas_totales("mes")
+
+        self.assertEqual(len(sentencias), 1)
+        self.assertIn("GROUP BY", sentencias[0])
+        self.assertEqual(data["periodos"], ["2024-03", "2024-04"])
+        self.assertEqual(data["totales"], [15.0, 20.0])
+
     def test_ventas_totales_rechaza_intervalo_invalido(self):
         with self.app.app_context():
             admin = self._crear_admin()
@@ -568,6 +1032,47 @@ class ProveedorAjaxTest(BaseTestCase):
         resp = self.client.get("/get_marcas?tipo_producto=Procesador", follow_redirects=False)
         self.assertEqual(resp.status_code, 302)
 
+    def test_endpoints_de_proveedor_devuelven_columna_o_404(self):
+        self._login_admin()
+        self.assertEqual(self.client.get(f"/proveedor/{self.proveedor_id}").get_json(), {"cif": "AJX123456"})
+        self.assertEqual(
+            self.client.get(f"/tipos-producto/{self.proveedor_id}").get_json(), {"tipos_producto": ["Ordenador"]}
+        )
+        self.assertEqual(self.client.get("/proveedor/noexiste").status_code, 404)
+        self.assertEqual(self.client.get("/tipos-producto/noexiste").status_code, 404)
+
+    def test_catalogos_json_responden_304_con_etag(self):
+        self._login_admin()
+        resp = self.client.get("/get_marcas?tipo_producto=Procesador")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.get_json()[0], {"id": 0, "nombre": "Intel"})
+        etag = resp.headers["ETag"]
+
+        resp_304 = self.client.get("/get_marcas?tipo_producto=Procesador", headers={"If-None-Match": etag})
+        self.assertEqual(resp_304.status_code, 304)
+        self.assertEqual(resp_304.data, b"")
+
+        resp_otro = self.client.get("/get_marcas?tipo_producto=RAM", headers={"If-None-Match": etag})
+        self.assertEqual(resp_otro.status_code, 200)
+
+        resp_modelos = self.client.get("/get_modelos?tipo_producto=RAM&marca=Kingston")
+        self.assertEqual(resp_modelos.status_code, 200)
+        self.assertEqual(resp_modelos.get_json()[0]["modelo"], "FURY Beast 16GB DDR5")
+        self.assertEqual(self.client.get("/get_modelos?tipo_producto=RAM&marca=Nada").status_code, 404)
+
+    def test_endpoints_de_proveedor_revalidan_con_etag(self):
+        self._login_admin()
+        marcas = self.client.get("/get_marcas?tipo_producto=RAM")
+        self.assertEqual(marcas.cache_control.max_age, 3600)
+        self.assertTrue(marcas.cache_control.private)
+
+        for url in (f"/proveedor/{self.proveedor_id}", f"/tipos-producto/{self.proveedor_id}"):
+            resp = self.client.get(url)
+            self.assertEqual(resp.status_code, 200)
+            self.assertTrue(resp.cache_control.no_cache)
+            resp_304 = self.client.get(url, headers={"If-None-Match": resp.headers["ETag"]})
+            self.assertEqual(resp_304.status_code, 304)
+
     def test_admin_puede_consumir_endpoints_y_editar_productos(self):
         self._login_admin()
         resp_tipos = self.client.get(f"/tipos-producto/{self.proveedor_id}")
@@ -600,6 +1105,175 @@ class ProveedorAjaxTest(BaseTestCase):
             proveedor = db.session.get(Proveedor, self.proveedor_id)
             self.assertEqual(proveedor.tipo_producto, "Ordenador, Procesador")
 
+        # Los tipos se leen de la BD en cada petición: ni la edición ni un
+        # cambio hecho por otro proceso dejan una respuesta obsoleta.
+        resp_tipos = self.client.get(f"/tipos-producto/{self.proveedor_id}")
+        self.assertEqual(resp_tipos.get_json(), {"tipos_producto": ["Ordenador", "Procesador"]})
+        with self.app.app_context():
+            db.session.add(ProveedorTipo(proveedor_id=self.proveedor_id, tipo="Placa Base"))
+            db.session.commit()
+        resp_tipos = self.client.get(f"/tipos-producto/{self.proveedor_id}")
+        self.assertEqual(resp_tipos.get_json(), {"tipos_producto": ["Ordenador", "Placa Base", "Procesador"]})
+
+    def test_editar_proveedor_registra_actividad_en_el_mismo_commit(self):
+        self._login_admin()
+        payload = [
+            ("nombre", "Proveedor Auditado"),
+            ("telefono", "999999999"),
+            ("direccion", "Dir Ajax"),
+            ("email", "prov_ajax@example.com"),
+            ("cif", "AJX123456"),
+            ("tasa_de_descuento", "5"),
+            ("iva", "21"),
+            ("productos", "Ordenador"),
+        ]
+        commits = []
+
+        def _contar_commit(conn):
+            commits.append(conn)
+
+        with self.app.app_context():
+            event.listen(db.engine, "commit", _contar_commit)
+            try:
+                resp = self.client.post(f"/editar_proveedor/{self.proveedor_id}", data=MultiDict(payload))
+            finally:
+                event.remove(db.engine, "commit", _contar_commit)
+            self.assertEqual(resp.status_code, 302)
+            self.assertEqual(len(commits), 1)
+            actividad = ActividadUsuario.query.filter_by(usuario_id=self.admin_id).one()
+            self.assertIn("Proveedor Auditado", actividad.accion)
+
+    def test_eliminar_proveedor_y_producto_sin_dejar_huerfanos(self):
+        with self.app.app_context():
+            producto = Producto(
+                proveedor_id=self.proveedor_id,
+                tipo_producto="Ordenador",
+                modelo="Equipo Ajax",
+                descripcion="",
+                cantidad=1,
+                cantidad_minima=0,
+                precio=100,
+                marca="Marca",
+                num_referencia="REF-AJAX",
+            )
+            db.session.add(producto)
+            db.session.commit()
+            producto_id = producto.id
+        self._login_admin()
+
+        # Con un producto que lo referencia, el proveedor no se borra.
+        self.assertEqual(self.client.post(f"/eliminar_proveedor/{self.proveedor_id}").status_code, 302)
+        with self.app.app_context():
+            self.assertIsNotNone(db.session.get(Proveedor, self.proveedor_id))
+
+        self.assertEqual(self.client.post(f"/eliminar_producto/{producto_id}").status_code, 302)
+        self.assertEqual(self.client.post(f"/eliminar_proveedor/{self.proveedor_id}").status_code, 302)
+        self.assertEqual(self.client.post(f"/eliminar_proveedor/{self.proveedor_id}").status_code, 404)
+        with self.app.app_context():
+            self.assertIsNone(db.session.get(Producto, producto_id))
+            self.assertEqual(db.session.scalar(select(func.count()).select_from(ProveedorTipo)), 0)
+            acciones = [a.accion for a in ActividadUsuario.query.order_by(ActividadUsuario.fecha)]
+            self.assertEqual(len(acciones), 2)
+            self.assertIn("Equipo Ajax", acciones[0])
+            self.assertIn("Proveedor Ajax", acciones[1])
+
+    def test_editar_producto_no_consulta_proveedor_al_guardar(self):
+        with self.app.app_context():
+            producto = Producto(
+                proveedor_id=self.proveedor_id,
+                tipo_producto="Ordenador",
+                modelo="Equipo Edit",
+                descripcion="",
+                cantidad=1,
+                cantidad_minima=0,
+                precio=100,
+                marca="Marca",
+                num_referencia="REF-EDIT",
+            )
+            db.session.add(producto)
+            db.session.commit()
+            producto_id = producto.id
+        self._login_admin()
+
+        with self.app.app_context(), contar_consultas(db.engine) as sentencias:
+            resp = self.client.post(
+                f"/editar_producto/{producto_id}",
+                data={"descripcion": "Nueva", "cantidad": "4", "cantidad_minima": "1", "precio": "120", "costo": "90", "num_referencia": "REF-EDIT"},
+            )
+        self.assertEqual(resp.status_code, 302)
+        self.assertFalse([s for s in sentencias if "FROM proveedor" in s and "SELECT" in s])
+        with self.app.app_context():
+            producto = db.session.get(Producto, producto_id)
+            self.assertEqual((producto.descripcion, producto.cantidad), ("Nueva", 4))
+
+    def test_filtro_por_tipo_usa_tabla_de_tipos(self):
+        with self.app.app_context():
+            otro = Proveedor(
+                nombre="Proveedor RAM",
+                telefono="888888888",
+                direccion="Dir RAM",
+                email="prov_ram@example.com",
+                cif="RAM123456",
+                tasa_de_descuento=0,
+                iva=21,
+                tipo_producto="RAM, Fuente",
+            )
+            db.session.add(otro)
+            db.session.commit()
+            self.assertEqual([tipo.tipo for tipo in otro.tipos], ["Fuente", "RAM"])
+            self.assertEqual(otro.tipo_producto, "Fuente, RAM")
+
+        self._login_admin()
+        listado = self.client.get("/proveedores?tipo=ram").data.decode("utf-8")
+        self.assertIn("Proveedor RAM", listado)
+        self.assertNotIn("Proveedor Ajax", listado)
+
+        csv_resp = self.client.get("/proveedores/export?tipo=Ordenador").data.decode("utf-8")
+        self.assertIn("Proveedor Ajax", csv_resp)
+        self.assertNotIn("Proveedor RAM", csv_resp)
+
+    def test_editar_proveedor_guarda_texto_sin_escapar(self):
+        self._login_admin()
+        payload = [
+            ("nombre", "Hnos. Pérez & Cía"),
+            ("telefono", "999999999"),
+            ("direccion", "Dir Ajax"),
+            ("email", "prov_ajax@example.com"),
+            ("cif", "AJX123456"),
+            ("tasa_de_descuento", "5"),
+            ("iva", "21"),
+            ("productos", "Ordenador"),
+        ]
+        resp_edit = self.client.post(f"/editar_proveedor/{self.proveedor_id}", data=MultiDict(payload))
+        self.assertEqual(resp_edit.status_code, 302)
+
+        with self.app.app_context():
+            proveedor = db.session.get(Proveedor, self.proveedor_id)
+            self.assertEqual(proveedor.nombre, "Hnos. Pérez & Cía")
+
+        listado = self.client.get("/proveedores").data.decode("utf-8")
+        self.assertIn("Hnos. Pérez &amp; Cía", listado)
+        self.assertNotIn("&amp;amp;", listado)
+
+    def test_editar_proveedor_rechaza_porcentaje_en_notacion_cientifica(self):
+        self._login_admin()
+        payload = [
+            ("nombre", "Proveedor Nuevo"),
+            ("telefono", "999999999"),
+            ("direccion", "Dir Ajax"),
+            ("email", "prov_ajax@example.com"),
+            ("cif", "AJX123456"),
+            ("tasa_de_descuento", "1e1"),
+            ("iva", "21"),
+            ("productos", "Ordenador"),
+        ]
+        resp_edit = self.client.post(f"/editar_proveedor/{self.proveedor_id}", data=MultiDict(payload))
+        self.assertEqual(resp_edit.status_code, 200)
+
+        with self.app.app_context():
+            proveedor = db.session.get(Proveedor, self.proveedor_id)
+            self.assertEqual(proveedor.nombre, "Proveedor Ajax")
+
     def test_editar_proveedor_rechaza_productos_fuera_de_catalogo(self):
         self._login_admin()
         payload = [
@@ -721,6 +1395,57 @@ class ReportesCacheTest(BaseTestCase):
         self.assertIn("miss", types)
         self.assertIn("hit", types)
 
+    def test_graficas_responden_304_con_etag(self):
+        self._login_admin()
+        resp = self.client.get("/data/distribucion_productos")
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("tipos", resp.get_json())
+        etag = resp.headers["ETag"]
+
+        resp_304 = self.client.get("/data/distribucion_productos", headers={"If-None-Match": etag})
+        self.assertEqual(resp_304.status_code, 304)
+        self.assertEqual(resp_304.data, b"")
+
+        resp_otro = self.client.get("/data/productos_mas_vendidos", headers={"If-None-Match": etag})
+        self.assertEqual(resp_otro.status_code, 200)
+
+    def test_escrituras_invalidan_cache_de_graficas(self):
+        with self.app.app_context():
+            proveedor = Proveedor(
+                nombre="Proveedor Cache",
+                telefono="123456789",
+                direccion="Ruta 1",
+                email="cache@example.com",
+                cif="C1234567D",
+                tasa_de_descuento=0,
+                iva=21.0,
+                tipo_producto="RAM",
+            )
+            db.session.add(proveedor)
+            db.session.flush()
+            producto = Producto(
+                proveedor_id=proveedor.id,
+                tipo_producto="RAM",
+                modelo="RAM Cache",
+                descripcion="",
+                cantidad=1,
+                cantidad_minima=0,
+                precio=5.0,
+                marca="Marca",
+                num_referencia="REF-C",
+            )
+            db.session.add(producto)
+            db.session.commit()
+            producto_id = producto.id
+
+        self._login_admin()
+        antes = self.client.get("/data/distribucion_productos").get_json()
+        self.assertEqual(antes["cantidades"], [1])
+
+        self.assertEqual(self.client.post(f"/eliminar_producto/{producto_id}").status_code, 302)
+        despues = self.client.get("/data/distribucion_productos").get_json()
+        self.assertEqual(despues["cantidades"], [])
+
     def test_chart_export_descarga_archivo(self):
         self._login_admin()
         self.client.get("/data/distribucion_productos")
@@ -799,6 +1524,194 @@ class ContabilidadFlowsTest(BaseTestCase):
             self.assertEqual(Asiento.query.count(), 1)
             asiento = Asiento.query.first()
             self.assertEqual(len(asiento.apuntes), 2)
+            self.assertEqual(asiento.fecha.date(), date(2024, 1, 2))
+
+    def test_nuevo_asiento_rechaza_fecha_invalida(self):
+        self._login_admin()
+        payload = MultiDict(
+            {
+                "descripcion": "Fecha rota",
+                "fecha": "02/01/2024",
+                "apuntes-0-cuenta_codigo": "570",
+                "apuntes-0-debe": "100",
+                "apuntes-0-haber": "0",
+                "apuntes-1-cuenta_codigo": "700",
+                "apuntes-1-debe": "0",
+                "apuntes-1-haber": "100",
+            }
+        )
+        resp = self.client.post("/contabilidad/nuevo-asiento", data=payload, follow_redirects=False)
+        self.assertEqual(resp.status_code, 200)
+        with self.app.app_context():
+            self.assertEqual(Asiento.query.count(), 0)
+
+    def test_nuevo_asiento_exige_dos_apuntes(self):
+        self._login_admin()
+        resp = self.client.get("/contabilidad/nuevo-asiento")
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn(b'name="apuntes-1-cuenta_codigo"', resp.data)
+
+        payload = MultiDict(
+            {
+                "descripcion": "Una sola linea",
+                "apuntes-0-cuenta_codigo": "570",
+                "apuntes-0-debe": "100",
+                "apuntes-0-haber": "0",
+                "apuntes-1-cuenta_codigo": "",
+                "apuntes-1-debe": "0",
+                "apuntes-1-haber": "0",
+            }
+        )
+        resp = self.client.post("/contabilidad/nuevo-asiento", data=payload, follow_redirects=False)
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("al menos 2 apuntes", resp.data.decode("utf-8"))
+        with self.app.app_context():
+            self.assertEqual(Asiento.query.count(), 0)
+
+    def test_nuevo_asiento_rechaza_linea_con_importes_sin_cuenta(self):
+        self._login_admin()
+        base = {
+            "descripcion": "Linea sin cuenta",
+            "apuntes-0-cuenta_codigo": "570",
+            "apuntes-0-debe": "100",
+            "apuntes-0-haber": "0",
+            "apuntes-1-cuenta_codigo": "700",
+            "apuntes-1-debe": "0",
+            "apuntes-1-haber": "60",
+            "apuntes-2-cuenta_codigo": "",
+        }
+        # Ni descuadrada ni cuadrada por sí sola: la línea no se descarta.
+        for debe, haber in (("0", "40"), ("25", "25")):
+            payload = MultiDict({**base, "apuntes-2-debe": debe, "apuntes-2-haber": haber})
+            resp = self.client.post("/contabilidad/nuevo-asiento", data=payload, follow_redirects=False)
+            self.assertEqual(resp.status_code, 200)
+            cuerpo = resp.data.decode("utf-8")
+            self.assertIn("Línea 3: falta la cuenta", cuerpo)
+            self.assertNotIn("descuadrado", cuerpo)
+        with self.app.app_context():
+            self.assertEqual(Asiento.query.count(), 0)
+
+    def test_nuevo_asiento_limite_cuenta_solo_lineas_rellenas(self):
+        self._login_admin()
+        datos = {
+            "descripcion": "Filas vacias de sobra",
+            "apuntes-0-cuenta_codigo": "570",
+            "apuntes-0-debe": "100",
+            "apuntes-0-haber": "0",
+            "apuntes-1-cuenta_codigo": "700",
+            "apuntes-1-debe": "0",
+            "apuntes-1-haber": "100",
+        }
+        for indice in range(2, 15):
+            datos.update({
+                f"apuntes-{indice}-cuenta_codigo": "",
+                f"apuntes-{indice}-debe": "0.00",
+                f"apuntes-{indice}-haber": "",
+            })
+        resp = self.client.post("/contabilidad/nuevo-asiento", data=MultiDict(datos), follow_redirects=False)
+        self.assertEqual(resp.status_code, 302)
+
+        for indice in range(2, 11):
+            datos.update({
+                f"apuntes-{indice}-cuenta_codigo": "570",
+                f"apuntes-{indice}-debe": "1",
+            })
+        resp = self.client.post("/contabilidad/nuevo-asiento", data=MultiDict(datos), follow_redirects=False)
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("Máximo 10 apuntes", resp.data.decode("utf-8"))
+        with self.app.app_context():
+            self.assertEqual(Asiento.query.count(), 1)
+
+    def test_saldos_agrupados_coinciden_con_saldo_por_cuenta(self):
+        from app.models import Cuenta
+
+        with self.app.app_context():
+            crear_asiento(
+                descripcion="Venta test",
+                usuario_id=self.admin_id,
+                apuntes_data=[
+                    {"cuenta_codigo": "570", "debe": 80, "haber": 0},
+                    {"cuenta_codigo": "700", "debe": 0, "haber": 80},
+                ],
+            )
+            crear_asiento(
+                descripcion="Devolución test",
+                usuario_id=self.admin_id,
+                apuntes_data=[
+                    {"cuenta_codigo": "700", "debe": 30, "haber": 0},
+                    {"cuenta_codigo": "570", "debe": 0, "haber": 30},
+                ],
+            )
+            db.session.commit()
+
+            cuentas = Cuenta.query.all()
+            with contar_consultas(db.engine) as sentencias:
+                saldos = obtener_saldos_cuentas(cuentas)
+            self.assertEqual(len(sentencias), 1)
+            self.assertEqual(saldos, {c.id: obtener_saldo_cuenta(c.id) for c in cuentas})
+            caja = next(c for c in cuentas if c.codigo == "570")
+            ventas = next(c for c in cuentas if c.codigo == "700")
+            self.assertEqual(saldos[caja.id], 50)
+            self.assertEqual(saldos[ventas.id], 50)
+
+    def test_crear_asiento_no_consulta_por_apunte(self):
+        with self.app.app_context():
+            with contar_consultas(db.engine) as dos_apuntes:
+                crear_asiento(
+                    descripcion="Dos líneas",
+                    usuario_id=self.admin_id,
+                    apuntes_data=[
+                        {"cuenta_codigo": "570", "debe": 10, "haber": 0},
+                        {"cuenta_codigo": "700", "debe": 0, "haber": 10},
+                    ],
+                )
+            with contar_consultas(db.engine) as cuatro_apuntes:
+                asiento = crear_asiento(
+                    descripcion="Cuatro líneas",
+                    usuario_id=self.admin_id,
+                    apuntes_data=[
+                        {"cuenta_codigo": "570", "debe": 10, "haber": 0},
+                        {"cuenta_codigo": "572", "debe": 5, "haber": 0},
+                        {"cuenta_codigo": "700", "debe": 0, "haber": 12},
+                        {"cuenta_codigo": "475", "debe": 0, "haber": 3},
+                    ],
+                )
+            db.session.commit()
+            self.assertEqual(len(dos_apuntes), len(cuatro_apuntes))
+            self.assertEqual(len(asiento.apuntes), 4)
+
+    def test_crear_asiento_tras_recrear_el_plan_usa_ids_vigentes(self):
+        apuntes = [
+            {"cuenta_codigo": "570", "debe": 10, "haber": 0},
+            {"cuenta_codigo": "700", "debe": 0, "haber": 10},
+        ]
+        with self.app.app_context():
+            crear_asiento(descripcion="Primero", usuario_id=self.admin_id, apuntes_data=apuntes)
+            db.session.commit()
+            # Otro proceso (o un drop_all) vacía el plan: las cuentas vuelven
+            # a crearse con IDs nuevos.
+            db.session.execute(Apunte.__table__.delete())
+            db.session.execute(Cuenta.__table__.delete())
+            db.session.commit()
+            crear_asiento(descripcion="Segundo", usuario_id=self.admin_id, apuntes_data=apuntes)
+            db.session.commit()
+
+            ids_cuenta = set(db.session.scalars(select(Cuenta.id)))
+            ids_apunte = set(db.session.scalars(select(Apunte.cuenta_id)))
+            self.assertTrue(ids_apunte)
+            self.assertLessEqual(ids_apunte, ids_cuenta)
+
+    def test_inicializar_plan_cuentas_solo_inserta_las_que_faltan(self):
+        with self.app.app_context():
+            with contar_consultas(db.engine) as completo:
+                inicializar_plan_cuentas()
+            self.assertEqual(len(completo), 1)
+
+            Cuenta.query.filter(Cuenta.codigo.in_(["570", "700"])).delete()
+            db.session.commit()
+            inicializar_plan_cuentas()
+            self.assertEqual(Cuenta.query.count(), 11)
+            self.assertEqual(Cuenta.query.filter_by(codigo="570").one().nombre, "Caja")
 
     def test_exportar_cuenta_resultados_csv(self):
         with self.app.app_context():